@@ -0,0 +1,219 @@
+"""
+Process-level registry of compiled ReAct SQL agents.
+
+`create_react_agent` compiles a LangGraph graph every time it is called. The
+model, tools and system prompt are fixed for the life of a worker, so the
+graph is compiled once (at startup via `warm_up`) and reused by every request.
+"""
+import logging
+import threading
+import time
+
+from typing_extensions import NotRequired
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import SystemMessage
+from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt.chat_agent_executor import AgentState
+
+import metrics
+from tracing import tracer
+
+logger = logging.getLogger("uvicorn")
+
+# Bump the version whenever the SQL agent prompt changes so cached graphs are rebuilt.
+SQL_AGENT_PROMPT_VERSION = "sql-agent-v3"
+
+SQL_AGENT_PROMPT = """
+                    You are an agent designed to interact with a SQL database.
+                    Given an input question, create a syntactically correct {dialect} query to run,
+                    then look at the results of the query and return the answer. Unless the user
+                    specifies a specific number of examples they wish to obtain, always limit your
+                    query to at most {top_k} results.
+
+                    You can order the results by a relevant column to return the most interesting
+                    examples in the database. Never query for all the columns from a specific table,
+                    only ask for the relevant columns given the question.
+
+                    You MUST double check your query before executing it. If you get an error while
+                    executing a query, rewrite the query and try again.
+
+                    DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the
+                    database.
+                    """
+
+# Used when no schema catalog context is available for the question.
+TABLE_DISCOVERY_INSTRUCTIONS = """
+                    To start you should ALWAYS look at the tables in the database to see what you
+                    can query. Do NOT skip this step.
+
+                    Then you should query the schema of the most relevant tables.
+                    """
+
+SCHEMA_CONTEXT_INSTRUCTIONS = """
+                    The schema of the tables most relevant to the question, with sample rows, is
+                    given below. Use it directly to write the query; do NOT list the tables or query
+                    the schema unless a table you need is not described here.
+
+{schema}
+"""
+
+EXAMPLES_INSTRUCTIONS = """
+                    Queries that correctly answered similar questions before are given below. Reuse
+                    them when they fit the question, adapting filters and values as needed.
+
+{examples}
+"""
+
+
+class SQLAgentState(AgentState):
+    # Schema catalog slice for the question, injected into the system prompt.
+    schema_context: NotRequired[str]
+    # Verified question/SQL pairs similar to the question (sql_examples.py).
+    examples: NotRequired[str]
+
+
+def render_sql_agent_prompt(dialect, top_k=5):
+    return SQL_AGENT_PROMPT.format(dialect=dialect, top_k=top_k)
+
+
+def sql_agent_prompt(system_prompt):
+    """
+    Build the callable prompt for `create_react_agent`: the static system prompt
+    followed by either the per-request schema context or the discovery steps,
+    then any few-shot examples for the question.
+    """
+    with_discovery = system_prompt + TABLE_DISCOVERY_INSTRUCTIONS
+
+    def prompt(state):
+        schema = state.get("schema_context")
+        if schema:
+            content = system_prompt + SCHEMA_CONTEXT_INSTRUCTIONS.format(schema=schema)
+        else:
+            content = with_discovery
+        examples = state.get("examples")
+        if examples:
+            content += EXAMPLES_INSTRUCTIONS.format(examples=examples)
+        return [SystemMessage(content=content)] + list(state["messages"])
+
+    return prompt
+
+
+class AgentRegistry:
+    """Thread-safe cache of compiled agents keyed by model, tool names and prompt version."""
+
+    def __init__(self):
+        self._agents = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    @staticmethod
+    def key(model, tools, prompt_version):
+        return (id(model), tuple(tool.name for tool in tools), prompt_version)
+
+    def get(self, model, tools, prompt, prompt_version, **agent_kwargs):
+        """Return the compiled agent for this key, building it on first use."""
+        key = self.key(model, tools, prompt_version)
+        agent = self._agents.get(key)
+        if agent is not None:
+            self.hits += 1
+            return agent
+
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is None:
+                start_time = time.perf_counter()
+                agent = create_react_agent(model, tools, prompt=prompt, **agent_kwargs)
+                self._agents[key] = agent
+                self.builds += 1
+                logger.info(
+                    f"Compiled SQL agent {prompt_version} with {len(tools)} tools in "
+                    f"{time.perf_counter() - start_time:.3f} seconds"
+                )
+            else:
+                self.hits += 1
+        return agent
+
+    def warm_up(self, model, tools, prompt, prompt_version, **agent_kwargs):
+        """Compile the agent ahead of the first request and return the elapsed seconds."""
+        start_time = time.perf_counter()
+        self.get(model, tools, prompt, prompt_version, **agent_kwargs)
+        return time.perf_counter() - start_time
+
+    def clear(self):
+        with self._lock:
+            self._agents.clear()
+
+    def stats(self):
+        return {"agents": len(self._agents), "builds": self.builds, "hits": self.hits}
+
+
+class AgentMetricsCallback(BaseCallbackHandler):
+    """
+    Times the SQL agent's tool calls and model calls into the Prometheus
+    histograms (metrics.py) and opens a trace span for each (tracing.py).
+    Attach it to the tools and the chat model; token counts come from
+    `prompt_registry.record_messages`.
+
+    Runs inline so a tool span is current while the tool executes and the SQL
+    statements it issues nest under it.
+    """
+
+    run_inline = True
+
+    def __init__(self, stage="sql_agent"):
+        self.stage = stage
+        self._started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        span = tracer.start_span(f"tool.{name}", activate=True, **{"tool.input": input_str})
+        self._started[run_id] = (name, time.perf_counter(), span)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        # The governed tools report failures as "Error: ..." results rather than raising.
+        content = str(getattr(output, "content", output))
+        self._finish_tool(run_id, "error" if content.startswith("Error") else "ok", content)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish_tool(run_id, "error", str(error))
+
+    def _finish_tool(self, run_id, status, content):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            name, start_time, span = started
+            metrics.TOOL_SECONDS.labels(name, status).observe(time.perf_counter() - start_time)
+            span.set("tool.status", status)
+            span.set("tool.output_chars", len(content))
+            if status == "error":
+                span.set("tool.error", content)
+            span.end()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        span = tracer.start_span("llm.chat", **{"llm.messages": sum(len(batch) for batch in messages)})
+        self._started[run_id] = (None, time.perf_counter(), span)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            metrics.LLM_SECONDS.labels(self.stage).observe(time.perf_counter() - started[1])
+            span = started[2]
+            try:
+                message = response.generations[0][0].message
+            except (AttributeError, IndexError):
+                message = None
+            usage = getattr(message, "usage_metadata", None) or {}
+            span.set("llm.prompt_tokens", usage.get("input_tokens"))
+            span.set("llm.completion_tokens", usage.get("output_tokens"))
+            span.set("llm.tool_calls", len(getattr(message, "tool_calls", None) or ()))
+            span.end()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            started[2].set_error(error)
+            started[2].end()
+
+
+registry = AgentRegistry()
@@ -0,0 +1,229 @@
+"""
+Answer cache keyed on the normalized rephrased query.
+
+Two tiers sit in front of the SQL agent:
+  * exact   - LRU/TTL map from the normalized query to the final answer
+  * similar - nearest-neighbour lookup over query embeddings (Azure embeddings
+              deployment + an in-memory `sqlite-vec` index); a hit above the
+              cosine similarity threshold returns the neighbour's answer only
+              if both queries name the same numbers and the same schema
+              values (countries, policy types, ...), since "employees in
+              mexico" and "employees in brazil" embed almost identically
+
+Every entry is dropped when `cs_latam.db` changes on disk. The similarity
+tier is optional: it is skipped when `sqlite-vec` is not installed or no
+embedding client is configured.
+"""
+import logging
+import re
+import sqlite3
+import threading
+
+from llm_client import AzureChatClient
+from schema_catalog import db_fingerprint
+from ttl_cache import TTLCache
+
+try:
+    import sqlite_vec
+except ImportError:  # pragma: no cover - optional dependency
+    sqlite_vec = None
+
+logger = logging.getLogger("uvicorn")
+
+NUMBER_RE = re.compile(
+    r"\b(\d+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|fifteen|twenty|fifty|hundred)\b"
+)
+
+
+def normalize_query(query):
+    """Same cleanup `query_orchestrator` applies to the rephrased query, plus case/space folding."""
+    query = re.sub(r'<stop>|[^a-zA-Z0-9\s]', '', query)
+    return " ".join(query.lower().split())
+
+
+def is_cacheable_answer(answer):
+    """Skip empty answers and the "not able to answer" fallbacks so they can be retried."""
+    return bool(answer and answer.strip()) and "may not be able to answer" not in answer.lower()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        db_path,
+        embedding_client=None,
+        maxsize=1024,
+        ttl=3600,
+        similarity_threshold=0.95,
+        dimensions=1536,
+        schema_catalog=None,
+    ):
+        self.db_path = db_path
+        self.schema_catalog = schema_catalog
+        self.embedding_client = embedding_client
+        self.similarity_threshold = similarity_threshold
+        self.dimensions = dimensions
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.similar_rejected = 0
+        self.misses = 0
+        self._fingerprint = db_fingerprint(db_path)
+        self._answers = TTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._drop_vector)
+        # Embeddings computed on a miss, reused when the answer is stored.
+        self._pending_embeddings = TTLCache(maxsize=256, ttl=300)
+        self._rowids = {}
+        self._keys = {}
+        self._next_rowid = 1
+        # Re-entrant: TTLCache eviction callbacks can fire while the lock is held.
+        self._vec_lock = threading.RLock()
+        self._vec = self._open_index() if embedding_client is not None else None
+
+    @classmethod
+    def from_config(cls, section, db_path, schema_catalog=None):
+        """Build the cache from `config.ini`; returns `None` when `answer_cache_enabled` is false."""
+        if not section.getboolean("answer_cache_enabled", fallback=True):
+            return None
+        embedding_client = None
+        if section.getboolean("answer_cache_similarity", fallback=True) and section.get("azure_embedding_url"):
+            embedding_client = AzureChatClient.from_config(
+                section, url_key="azure_embedding_url", api_key_key="azure_embedding_api_key"
+            )
+        return cls(
+            db_path,
+            embedding_client=embedding_client,
+            maxsize=section.getint("answer_cache_size", fallback=1024),
+            ttl=section.getfloat("answer_cache_ttl", fallback=3600),
+            similarity_threshold=section.getfloat("answer_cache_similarity_threshold", fallback=0.95),
+            dimensions=section.getint("answer_cache_embedding_dimensions", fallback=1536),
+            schema_catalog=schema_catalog,
+        )
+
+    async def aclose(self):
+        if self.embedding_client is not None:
+            await self.embedding_client.aclose()
+
+    def _open_index(self):
+        if sqlite_vec is None:
+            logger.warning("sqlite-vec is not installed; answer cache similarity tier disabled")
+            return None
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        conn.execute(
+            f"CREATE VIRTUAL TABLE answer_vectors USING vec0(embedding float[{self.dimensions}] distance_metric=cosine)"
+        )
+        return conn
+
+    @property
+    def similarity_enabled(self):
+        return self._vec is not None
+
+    def _check_db(self):
+        fingerprint = db_fingerprint(self.db_path)
+        if fingerprint != self._fingerprint:
+            self._fingerprint = fingerprint
+            if len(self._answers):
+                logger.info("Answer cache invalidated: database changed")
+            self.clear()
+
+    def clear(self):
+        self._answers.clear()
+        self._pending_embeddings.clear()
+
+    def _drop_vector(self, key, _answer):
+        if self._vec is None:
+            return
+        with self._vec_lock:
+            rowid = self._rowids.pop(key, None)
+            if rowid is not None:
+                self._keys.pop(rowid, None)
+                self._vec.execute("DELETE FROM answer_vectors WHERE rowid = ?", (rowid,))
+
+    def parameters(self, key):
+        """The numbers and schema values in a normalized query; a similar hit must match them exactly."""
+        numbers = tuple(sorted(NUMBER_RE.findall(key)))
+        values = self.schema_catalog.value_mentions(key) if self.schema_catalog is not None else frozenset()
+        return numbers, values
+
+    async def _embedding(self, key):
+        embedding = self._pending_embeddings.get(key, count=False)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = (await self.embedding_client.embed([key]))[0]
+        except Exception as e:
+            logger.warning(f"Answer cache embedding failed, skipping similarity tier: {e}")
+            return None
+        self._pending_embeddings.set(key, embedding)
+        return embedding
+
+    async def get(self, query):
+        """Return `(answer, tier)` for a cached query, or `None` on a miss."""
+        self._check_db()
+        key = normalize_query(query)
+        if not key:
+            return None
+
+        answer = self._answers.get(key)
+        if answer is not None:
+            self.exact_hits += 1
+            return answer, "exact"
+
+        if self._vec is not None:
+            embedding = await self._embedding(key)
+            if embedding is not None:
+                with self._vec_lock:
+                    row = self._vec.execute(
+                        "SELECT rowid, distance FROM answer_vectors WHERE embedding MATCH ? AND k = 1",
+                        (sqlite_vec.serialize_float32(embedding),),
+                    ).fetchone()
+                    neighbour = None
+                    if row is not None and 1 - row[1] >= self.similarity_threshold:
+                        neighbour = self._keys.get(row[0])
+                if neighbour is not None and self.parameters(neighbour) != self.parameters(key):
+                    self.similar_rejected += 1
+                    neighbour = None
+                if neighbour is not None:
+                    answer = self._answers.get(neighbour, count=False)
+                    if answer is not None:
+                        self.similar_hits += 1
+                        return answer, "similar"
+
+        self.misses += 1
+        return None
+
+    async def put(self, query, answer):
+        key = normalize_query(query)
+        if not key or not is_cacheable_answer(answer):
+            return
+        self._answers.set(key, answer)
+
+        if self._vec is None:
+            return
+        embedding = await self._embedding(key)
+        if embedding is None:
+            return
+        with self._vec_lock:
+            if key in self._rowids or key not in self._answers:
+                return
+            rowid = self._next_rowid
+            self._next_rowid += 1
+            self._vec.execute(
+                "INSERT INTO answer_vectors(rowid, embedding) VALUES (?, ?)",
+                (rowid, sqlite_vec.serialize_float32(embedding)),
+            )
+            self._rowids[key] = rowid
+            self._keys[rowid] = key
+        self._pending_embeddings.pop(key)
+
+    def stats(self):
+        total = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "size": len(self._answers),
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "similar_rejected": self.similar_rejected,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.similar_hits) / total if total else 0.0,
+            "similarity_enabled": self.similarity_enabled,
+        }
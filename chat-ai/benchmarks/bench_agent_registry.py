@@ -0,0 +1,73 @@
+"""
+Benchmark: per-request `create_react_agent` vs. the process-level agent registry.
+
+Runs fully offline with a fake chat model and the real SQLDatabaseToolkit
+tools over an in-memory SQLite database, so only graph construction is timed.
+
+    python benchmarks/bench_agent_registry.py --iterations 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_community.agent_toolkits import SQLDatabaseToolkit
+from langchain_community.utilities import SQLDatabase
+from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+from langchain_core.messages import AIMessage
+from langgraph.prebuilt import create_react_agent
+
+from agent_registry import SQL_AGENT_PROMPT_VERSION, AgentRegistry, render_sql_agent_prompt
+
+
+class ToolCallingFakeModel(FakeMessagesListChatModel):
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[int(len(samples) * 0.95) - 1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    model = ToolCallingFakeModel(responses=[AIMessage(content="ok")])
+    db = SQLDatabase.from_uri("sqlite://")
+    tools = SQLDatabaseToolkit(db=db, llm=model).get_tools()
+
+    per_request = []
+    for _ in range(args.iterations):
+        start_time = time.perf_counter()
+        create_react_agent(model, tools, prompt=render_sql_agent_prompt(db.dialect, top_k=5))
+        per_request.append(time.perf_counter() - start_time)
+
+    registry = AgentRegistry()
+    prompt = render_sql_agent_prompt(db.dialect, top_k=5)
+    warm_up = registry.warm_up(model, tools, prompt, SQL_AGENT_PROMPT_VERSION)
+    cached = []
+    for _ in range(args.iterations):
+        start_time = time.perf_counter()
+        registry.get(model, tools, prompt, SQL_AGENT_PROMPT_VERSION)
+        cached.append(time.perf_counter() - start_time)
+
+    print(f"iterations: {args.iterations}")
+    print(f"warm-up (one-off compile): {warm_up * 1000:.3f} ms")
+    for name, samples in (("create_react_agent per request", per_request), ("registry lookup", cached)):
+        stats = summarize(samples)
+        print(f"{name:32s} mean {stats['mean_ms']:.4f} ms  p50 {stats['p50_ms']:.4f} ms  p95 {stats['p95_ms']:.4f} ms")
+    print(f"registry stats: {registry.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Benchmark: the full request pipeline, offline.
+
+Starts the mock Azure OpenAI server (mock_azure.py), builds a synthetic
+`cs_latam.db` (synthetic_db.py) and a config.ini pointing at both in a scratch
+directory, then imports `main` (`query_orchestrator`) or `main_langraph`
+(`sql_query_workflow`) and replays a workload at a fixed concurrency.
+
+Reports end-to-end and per-stage latency percentiles (guardrail, rephraser,
+answer cache, SQL template, SQL agent, SQL execution), LLM calls and tokens
+per request (from the prompt registry and from the mock server), and memory.
+Results are written as JSON so runs can be compared across commits:
+
+    python benchmarks/bench_pipeline.py --app main --requests 200 --concurrency 8 --output results/main.json
+    python benchmarks/bench_pipeline.py --app all --set answer_cache_enabled=false --compare results/main.json
+
+`--latency STAGE=SPEC` and `--rate-limit` shape the mock (see mock_azure.py);
+`--set KEY=VALUE` overrides any config.ini key for the run.
+"""
+import argparse
+import asyncio
+import configparser
+import contextvars
+import functools
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic_db
+from mock_azure import MockAzureOpenAI, chat_url, embeddings_url, load_scripts
+
+DEFAULT_WORKLOAD = os.path.join(BENCH_DIR, "data", "pipeline_workload.jsonl")
+
+# Module attributes timed per app: name -> stage.
+TIMED_FUNCTIONS = {
+    "main": {
+        "guardrail": "guardrail",
+        "query_rephraser": "rephraser",
+        "cached_answer": "answer_cache",
+        "template_answer": "sql_template",
+        "response_generator": "sql_agent",
+    },
+    "langraph": {
+        "guardrails_agent": "guardrail",
+        "query_rephraser_agent": "rephraser",
+        "response_generation_agent": "answer",
+    },
+}
+
+_stage_times = contextvars.ContextVar("bench_stage_times", default=None)
+
+
+def record_stage(stage, elapsed):
+    times = _stage_times.get()
+    if times is not None:
+        times[stage] += elapsed
+
+
+def timed(stage, func):
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start_time)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record_stage(stage, time.perf_counter() - start_time)
+    return wrapper
+
+
+def instrument(module, app):
+    """Wrap the app's stage functions (and the SQL governor) with per-request timers."""
+    for name, stage in TIMED_FUNCTIONS[app].items():
+        target = getattr(module, name)
+        if hasattr(target, "func"):
+            # LangGraph @task: re-wrap the underlying function so it stays a task.
+            from langgraph.func import task
+
+            setattr(module, name, task(timed(stage, target.func)))
+        else:
+            setattr(module, name, timed(stage, target))
+    governor = module.sql_governor
+    governor.execute = timed("sql", governor.execute)
+    governor.fetch = timed("sql", governor.fetch)
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    samples = sorted(samples)
+
+    def pick(q):
+        return samples[min(len(samples) - 1, int(len(samples) * q))] * 1000
+
+    return {
+        "count": len(samples),
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def load_workload(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_config(workdir, mock_base_url, overrides):
+    """config.ini for the run: config.ini.example pointed at the mock server, plus `overrides`."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(APP_DIR, "configs", "config.ini.example"))
+    section = config["DEFAULT"]
+    section["azure_llm_gpt4_url"] = chat_url(mock_base_url)
+    section["azure_embedding_url"] = embeddings_url(mock_base_url)
+    section["azure_api_key"] = "offline-benchmark"
+    section["azure_embedding_api_key"] = "offline-benchmark"
+    section["llm_ssl_verify"] = "false"
+    for item in overrides:
+        key, _, value = item.partition("=")
+        section[key.strip()] = value.strip()
+    path = os.path.join(workdir, "config.ini")
+    with open(path, "w", encoding="utf-8") as f:
+        config.write(f)
+    return path
+
+
+def memory_kib():
+    # ru_maxrss is KiB on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=APP_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=APP_DIR, capture_output=True, text=True
+        ).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+async def invoke(module, app, item, index, args):
+    parameters = {
+        "UserID": f"bench-user-{index % args.users}",
+        "request_id": f"bench-{index}",
+        "Speculative_Guardrail": args.speculative,
+    }
+    if app == "main":
+        return await module.query_orchestrator(module.RAGModel(inputs=item["question"], parameters=parameters))
+    config = {"configurable": {"thread_id": f"{parameters['UserID']}_{parameters['request_id']}"}}
+    return await module.app_workflow.ainvoke(
+        {"inputs": item["question"], "parameters": parameters, "chat_history": []}, config=config
+    )
+
+
+async def run_requests(module, app, workload, args):
+    prompt_registry = module.prompt_registry
+    results = []
+    queue = asyncio.Queue()
+    for index in range(args.requests):
+        queue.put_nowait(index)
+
+    async def one(index):
+        item = workload[index % len(workload)]
+        stages = defaultdict(float)
+        _stage_times.set(stages)
+        prompt_registry.start_request()
+        start_time = time.perf_counter()
+        status, error = None, None
+        try:
+            response = await invoke(module, app, item, index, args)
+            status = response.get("statusCode") if isinstance(response, dict) else None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        results.append({
+            "question": item["question"],
+            "latency": time.perf_counter() - start_time,
+            "status": status,
+            "error": error,
+            "stages": dict(stages),
+            "usage": prompt_registry.request_usage(),
+        })
+
+    async def worker():
+        while not queue.empty():
+            index = queue.get_nowait()
+            # Each request in its own task, as uvicorn runs them, so context vars do not leak.
+            await asyncio.create_task(one(index))
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    return results, time.perf_counter() - start_time
+
+
+def summarize(results, wall_time, mock_stats, memory):
+    stage_samples = defaultdict(list)
+    usage = defaultdict(lambda: defaultdict(list))
+    for result in results:
+        for stage, elapsed in result["stages"].items():
+            stage_samples[stage].append(elapsed)
+        for stage, entry in result["usage"].items():
+            for key in ("calls", "prompt_tokens", "completion_tokens"):
+                usage[stage][key].append(entry[key])
+    requests = len(results)
+    errors = [result for result in results if result["error"] or result["status"] != 200]
+    per_request = {
+        stage: {key: sum(values) / requests for key, values in entry.items()}
+        for stage, entry in usage.items()
+    }
+    mock_totals = {key: sum(entry.get(key, 0) for entry in mock_stats.values())
+                   for key in ("calls", "rate_limited", "prompt_tokens", "completion_tokens")}
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "error_samples": sorted({result["error"] or f"status {result['status']}" for result in errors})[:5],
+        "wall_time_s": wall_time,
+        "throughput_rps": requests / wall_time if wall_time else 0.0,
+        "latency": percentiles([result["latency"] for result in results]),
+        "stages": {stage: percentiles(samples) for stage, samples in sorted(stage_samples.items())},
+        "llm": {
+            "per_request": per_request,
+            "calls_per_request": mock_totals["calls"] / requests,
+            "tokens_per_request": (mock_totals["prompt_tokens"] + mock_totals["completion_tokens"]) / requests,
+            "mock": {"totals": mock_totals, "stages": mock_stats},
+        },
+        "memory": memory,
+    }
+
+
+def run_app(app, args):
+    """Run one app in this process; returns its summary."""
+    workdir = args.workdir or tempfile.mkdtemp(prefix=f"bench-{app}-")
+    os.makedirs(workdir, exist_ok=True)
+    db_rows = synthetic_db.build(os.path.join(workdir, "cs_latam.db"), args.employees, args.seed)
+    scripts, unsafe = load_scripts(args.workload)
+    workload = load_workload(args.workload)
+
+    with MockAzureOpenAI(
+        latency=args.latency, rate_limit=args.rate_limit, retry_after=args.retry_after,
+        scripts=scripts, unsafe=unsafe, seed=args.seed,
+    ) as mock:
+        os.environ["CHAT_AI_CONFIG"] = write_config(workdir, mock.base_url, args.set)
+        os.environ["log_dir"] = os.path.join(workdir, "app_logs")
+        # DB_PATH and the store paths in config.ini are relative to the working directory.
+        os.chdir(workdir)
+        if args.tracemalloc:
+            tracemalloc.start()
+        rss_before = memory_kib()
+        import_start = time.perf_counter()
+        module = __import__("main" if app == "main" else "main_langraph")
+        import_time = time.perf_counter() - import_start
+        instrument(module, app)
+
+        async def run():
+            async with module.lifespan(module.app):
+                rss_ready = memory_kib()
+                results, wall_time = await run_requests(module, app, workload, args)
+            return results, wall_time, rss_ready
+
+        results, wall_time, rss_ready = asyncio.run(run())
+        memory = {"rss_before_import_kib": rss_before, "rss_ready_kib": rss_ready, "rss_peak_kib": memory_kib()}
+        if args.tracemalloc:
+            memory["python_heap_peak_kib"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        summary = summarize(results, wall_time, mock.stats(), memory)
+    summary["import_time_s"] = import_time
+    summary["db_rows"] = db_rows
+    summary["workdir"] = workdir
+    return summary
+
+
+def run_children(args, argv):
+    """`--app all`: run each app in a fresh process so imports and memory do not mix."""
+    runs = {}
+    for app in ("main", "langraph"):
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            output = f.name
+        child = [sys.executable, os.path.abspath(__file__), *argv, "--app", app, "--output", output, "--quiet"]
+        subprocess.run(child, check=True)
+        with open(output, encoding="utf-8") as f:
+            runs.update(json.load(f)["runs"])
+        os.remove(output)
+    return runs
+
+
+def print_summary(runs):
+    for app, summary in runs.items():
+        latency = summary["latency"]
+        print(f"\n[{app}] {summary['requests']} requests, {summary['errors']} errors, "
+              f"{summary['throughput_rps']:.2f} req/s, "
+              f"{summary['llm']['calls_per_request']:.2f} LLM calls and "
+              f"{summary['llm']['tokens_per_request']:.0f} tokens per request")
+        print(f"  {'stage':14s} {'count':>6s} {'p50 ms':>9s} {'p90 ms':>9s} {'p99 ms':>9s}")
+        for stage, stats in (("end_to_end", latency), *summary["stages"].items()):
+            if stats["count"]:
+                print(f"  {stage:14s} {stats['count']:6d} {stats['p50_ms']:9.1f} {stats['p90_ms']:9.1f} {stats['p99_ms']:9.1f}")
+        print(f"  memory: {summary['memory']}")
+        for error in summary["error_samples"]:
+            print(f"  error: {error}")
+
+
+def compare(runs, baseline_path):
+    """Print the change of the main metrics against an earlier result file."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nAgainst {baseline_path} ({(baseline['meta'].get('git') or {}).get('commit')}):")
+    for app, summary in runs.items():
+        before = baseline["runs"].get(app)
+        if before is None:
+            continue
+        metrics = [
+            ("throughput_rps", before["throughput_rps"], summary["throughput_rps"]),
+            ("llm calls/request", before["llm"]["calls_per_request"], summary["llm"]["calls_per_request"]),
+            ("tokens/request", before["llm"]["tokens_per_request"], summary["llm"]["tokens_per_request"]),
+            ("rss_peak_kib", before["memory"]["rss_peak_kib"], summary["memory"]["rss_peak_kib"]),
+        ]
+        for stage, stats in (("end_to_end", summary["latency"]), *summary["stages"].items()):
+            old = before["latency"] if stage == "end_to_end" else before["stages"].get(stage)
+            if old and old.get("count") and stats.get("count"):
+                metrics.append((f"{stage} p50_ms", old["p50_ms"], stats["p50_ms"]))
+                metrics.append((f"{stage} p95_ms", old["p95_ms"], stats["p95_ms"]))
+        print(f"[{app}]")
+        for name, old, new in metrics:
+            change = (new - old) / old if old else 0.0
+            print(f"  {name:28s} {old:12.2f} -> {new:12.2f}  ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "langraph", "all"], default="main")
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--users", type=int, default=1000, help="distinct UserIDs the requests are spread over")
+    parser.add_argument("--speculative", action="store_true", help="run with Speculative_Guardrail")
+    parser.add_argument("--latency", action="append", default=[], metavar="STAGE=SPEC")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of LLM calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--employees", type=int, default=5000, help="rows in the synthetic employees table")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="config.ini override")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="scratch directory (default: a new temp dir)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--output", help="write the results JSON here")
+    parser.add_argument("--compare", metavar="BASELINE", help="results JSON of an earlier run")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+    args.workload = os.path.abspath(args.workload)
+    output = os.path.abspath(args.output) if args.output else None
+
+    if args.app == "all":
+        argv = list(sys.argv[1:])
+        for flag in ("--app", "--output", "--compare"):
+            if flag in argv:
+                position = argv.index(flag)
+                del argv[position:position + 2]
+        runs = run_children(args, argv)
+    else:
+        runs = {args.app: run_app(args.app, args)}
+
+    options = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "quiet")}
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": options,
+        },
+        "runs": runs,
+    }
+    if output:
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if not args.quiet:
+        print_summary(runs)
+        if output:
+            print(f"\nresults written to {output}")
+    if args.compare:
+        compare(runs, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Benchmark: local pre-guardrail accuracy and latency on a labelled corpus.
+
+Reports, for the verdicts the pre-guardrail decides locally, per-class
+precision/recall plus coverage (share of inputs that never reach the Azure
+guardrail), and per-input latency for `classify` and `classify_batch`.
+
+The model was fitted on guardrail_corpus.jsonl, so the held-out
+guardrail_holdout.jsonl is the figure to trust. Items marked
+`"regression": true` are known bypasses; the script exits non-zero if any of
+them gets a local Safe verdict.
+
+    python benchmarks/bench_pre_guardrail.py
+    python benchmarks/bench_pre_guardrail.py --corpus benchmarks/data/guardrail_holdout.jsonl --verbose
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pre_guardrail
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEFAULT_CORPORA = [
+    os.path.join(DATA_DIR, "guardrail_corpus.jsonl"),
+    os.path.join(DATA_DIR, "guardrail_holdout.jsonl"),
+]
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def evaluate(name, corpus, verbose):
+    """Print coverage and per-class precision/recall; returns regression items decided Safe."""
+    texts = [item["text"] for item in corpus]
+    labels = [item["label"].capitalize() for item in corpus]
+    results = [pre_guardrail.classify(text) for text in texts]
+
+    decided = [(label, result) for label, result in zip(labels, results) if result.verdict is not None]
+    print(f"{name}: {len(corpus)} inputs, decided locally: {len(decided)} ({len(decided) / len(corpus):.1%})")
+    for cls in ("Safe", "Unsafe"):
+        predicted = sum(1 for _, result in decided if result.verdict == cls)
+        correct = sum(1 for label, result in decided if result.verdict == cls and label == cls)
+        actual = sum(1 for label in labels if label == cls)
+        precision = correct / predicted if predicted else 0.0
+        recall = correct / actual if actual else 0.0
+        print(f"  {cls:7s} predicted {predicted:3d}  precision {precision:.3f}  recall {recall:.3f}  (of {actual})")
+
+    if verbose:
+        for text, label, result in zip(texts, labels, results):
+            if result.verdict != label:
+                status = "ambiguous" if result.verdict is None else "WRONG"
+                print(f"    {status:9s} {label:6s} {result.score:7.2f} {text[:70]}")
+
+    return [
+        item["text"] for item, result in zip(corpus, results)
+        if item.get("regression") and result.verdict == "Safe"
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", action="append", help="labelled JSONL; repeatable (default: fit + held-out sets)")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--verbose", action="store_true", help="print every misclassified or ambiguous input")
+    args = parser.parse_args()
+
+    texts = []
+    regressions = []
+    for path in args.corpus or DEFAULT_CORPORA:
+        corpus = load_corpus(path)
+        texts.extend(item["text"] for item in corpus)
+        regressions.extend(evaluate(os.path.basename(path), corpus, args.verbose))
+
+    for text in regressions:
+        print(f"REGRESSION: locally Safe: {text[:70]}")
+
+    single = []
+    for _ in range(args.iterations):
+        for text in texts:
+            start_time = time.perf_counter()
+            pre_guardrail.classify(text)
+            single.append(time.perf_counter() - start_time)
+
+    batch = []
+    for _ in range(args.iterations):
+        start_time = time.perf_counter()
+        pre_guardrail.classify_batch(texts)
+        batch.append((time.perf_counter() - start_time) / len(texts))
+
+    for name, samples in (("classify", single), ("classify_batch (per input)", batch)):
+        print(
+            f"{name:28s} mean {statistics.mean(samples) * 1e6:.1f} us  "
+            f"p50 {percentile(samples, 0.5) * 1e6:.1f} us  p99 {percentile(samples, 0.99) * 1e6:.1f} us"
+        )
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
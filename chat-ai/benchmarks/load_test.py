@@ -0,0 +1,362 @@
+"""
+Load test: closed-loop virtual users against `POST /invocations`.
+
+Each virtual user replays multi-turn conversations from
+data/conversations.jsonl, sending the next turn as soon as the previous
+answer arrives (plus `--think-time`). A conversation keeps one UserID and
+session_id and uses one history mode, drawn from `--history-mix`:
+
+  server  - the service's own conversation store (no chat_history sent)
+  client  - the previous turns sent as `parameters.chat_history`
+  fresh   - `Conversation_History: false`, so every turn starts afresh
+
+Concurrency is ramped through `--concurrency` (e.g. 1,2,4,8,16,32). Each level
+runs for `--duration` seconds after `--warmup`, and then reports throughput,
+latency percentiles and the error rate. In-flight requests drain before the
+next level starts. The ramp stops once p99 or the error rate exceeds
+`--max-p99` / `--max-error-rate`.
+
+Without `--url` the tool runs fully offline. It starts the mock Azure OpenAI
+server (mock_azure.py) in its own process, builds a synthetic cs_latam.db
+and a config.ini in a scratch directory, and serves `main:app` or
+`main_langraph:app` with one uvicorn worker:
+
+    python benchmarks/load_test.py --app main --concurrency 1,2,4,8,16,32 --duration 30 --output results/load_main.json
+    python benchmarks/load_test.py --url http://127.0.0.1:8506 --concurrency 4,8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import synthetic_db
+from bench_pipeline import git_revision, percentiles, write_config
+
+DEFAULT_CONVERSATIONS = os.path.join(BENCH_DIR, "data", "conversations.jsonl")
+DEFAULT_WORKLOAD = os.path.join(BENCH_DIR, "data", "pipeline_workload.jsonl")
+HISTORY_MODES = ("server", "client", "fresh")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(text):
+    """`server=0.6,client=0.2,fresh=0.2` -> weights per history mode."""
+    weights = dict.fromkeys(HISTORY_MODES, 0.0)
+    for item in text.split(","):
+        mode, _, weight = item.partition("=")
+        if mode not in weights:
+            raise ValueError(f"unknown history mode {mode!r}; use {', '.join(HISTORY_MODES)}")
+        weights[mode] = float(weight)
+    return weights
+
+
+def load_conversations(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["turns"] for line in f if line.strip()]
+
+
+def server_rss_kib(pid):
+    """Resident memory of the uvicorn process, when psutil is installed."""
+    try:
+        import psutil
+
+        return psutil.Process(pid).memory_info().rss // 1024
+    except Exception:
+        return None
+
+
+class LocalService:
+    """Mock Azure OpenAI + one uvicorn worker of the app, in a scratch directory."""
+
+    def __init__(self, app, args):
+        self.app = app
+        self.args = args
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix=f"load-{app}-")
+        self.mock = None
+        self.server = None
+        self.mock_stats = None
+        self.url = None
+
+    def start(self):
+        args = self.args
+        os.makedirs(self.workdir, exist_ok=True)
+        synthetic_db.build(os.path.join(self.workdir, "cs_latam.db"), args.employees, args.seed)
+
+        mock_port = free_port()
+        mock_command = [
+            sys.executable, os.path.join(BENCH_DIR, "mock_azure.py"), "--port", str(mock_port),
+            "--workload", args.workload, "--rate-limit", str(args.rate_limit), "--seed", str(args.seed),
+        ]
+        for spec in args.latency:
+            mock_command += ["--latency", spec]
+        self.mock = subprocess.Popen(mock_command, stdout=subprocess.PIPE, text=True)
+
+        port = free_port()
+        env = {
+            **os.environ,
+            "CHAT_AI_CONFIG": write_config(self.workdir, f"http://127.0.0.1:{mock_port}", args.set),
+            "log_dir": os.path.join(self.workdir, "app_logs"),
+        }
+        module = "main" if self.app == "main" else "main_langraph"
+        self.server = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", f"{module}:app", "--app-dir", APP_DIR,
+                "--host", "127.0.0.1", "--port", str(port), "--workers", "1", "--log-level", "warning",
+            ],
+            cwd=self.workdir,
+            env=env,
+        )
+        self.url = f"http://127.0.0.1:{port}"
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + self.args.startup_timeout
+        while time.monotonic() < deadline:
+            if self.server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {self.server.returncode} during startup")
+            try:
+                if httpx.get(f"{self.url}/openapi.json", timeout=2).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.5)
+        raise RuntimeError(f"{self.app} did not start within {self.args.startup_timeout}s")
+
+    def stop(self):
+        if self.server is not None and self.server.poll() is None:
+            # SIGINT lets uvicorn run the lifespan shutdown (stats, store flushes).
+            self.server.send_signal(signal.SIGINT)
+            try:
+                self.server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.server.kill()
+        if self.mock is not None and self.mock.poll() is None:
+            # The mock prints its per-stage call/token totals on SIGINT.
+            self.mock.send_signal(signal.SIGINT)
+            try:
+                output, _ = self.mock.communicate(timeout=10)
+                self.mock_stats = json.loads(output[output.index("{"):])
+            except (subprocess.TimeoutExpired, ValueError):
+                self.mock.kill()
+
+
+class VirtualUser:
+    def __init__(self, number, conversations, mix, rng):
+        self.user_id = f"load-user-{number}"
+        self.conversations = conversations
+        self.modes, self.weights = zip(*mix.items())
+        self.rng = rng
+        self._start_conversation()
+
+    def _start_conversation(self):
+        self.turns = self.rng.choice(self.conversations)
+        self.turn = 0
+        self.session_id = uuid.uuid4().hex[:12]
+        self.mode = self.rng.choices(self.modes, self.weights)[0]
+        self.history = []
+
+    def next_request(self):
+        if self.turn >= len(self.turns):
+            self._start_conversation()
+        parameters = {
+            "UserID": self.user_id,
+            "session_id": self.session_id,
+            "request_id": f"{self.session_id}-{self.turn}",
+        }
+        if self.mode == "fresh":
+            parameters["Conversation_History"] = False
+        elif self.mode == "client":
+            parameters["chat_history"] = list(self.history)
+        return {"inputs": self.turns[self.turn], "parameters": parameters}
+
+    def record_answer(self, question, answer):
+        self.history += [{"role": "user", "content": question}, {"role": "assistant", "content": answer or ""}]
+        self.turn += 1
+
+
+async def send(client, url, body, timeout):
+    """`(latency, error, answer)` of one request; `error` is None for a 200 with a non-error body."""
+    start_time = time.perf_counter()
+    try:
+        response = await client.post(f"{url}/invocations", json=body, timeout=timeout)
+    except httpx.TimeoutException:
+        return time.perf_counter() - start_time, "timeout", None
+    except httpx.TransportError as e:
+        return time.perf_counter() - start_time, type(e).__name__, None
+    latency = time.perf_counter() - start_time
+    if response.status_code != 200:
+        return latency, f"HTTP {response.status_code}", None
+    try:
+        result = response.json()
+    except ValueError:
+        return latency, "invalid JSON", None
+    status = result.get("statusCode", 200) if isinstance(result, dict) else 200
+    if status >= 400:
+        return latency, f"statusCode {status}", result.get("body")
+    return latency, None, result.get("body") if isinstance(result, dict) else None
+
+
+async def run_level(client, url, concurrency, users, args):
+    """Closed loop at `concurrency` users; counts requests completed inside the measurement window."""
+    loop_start = time.perf_counter()
+    window_start = loop_start + args.warmup
+    window_end = window_start + args.duration
+    samples = []
+    errors = {}
+
+    async def user_loop(user):
+        while time.perf_counter() < window_end:
+            body = user.next_request()
+            started = time.perf_counter()
+            latency, error, answer = await send(client, url, body, args.timeout)
+            finished = started + latency
+            if window_start <= finished <= window_end:
+                samples.append((latency, error))
+                if error:
+                    errors[error] = errors.get(error, 0) + 1
+            if error:
+                # Drop the conversation on failure, as a real client would start over.
+                user.turn = len(user.turns)
+            else:
+                user.record_answer(body["inputs"], answer)
+            if args.think_time:
+                await asyncio.sleep(user.rng.expovariate(1 / args.think_time))
+
+    await asyncio.gather(*(user_loop(user) for user in users[:concurrency]))
+    latencies = [latency for latency, _ in samples]
+    failed = sum(1 for _, error in samples if error)
+    return {
+        "concurrency": concurrency,
+        "completed": len(samples),
+        "throughput_rps": len(samples) / args.duration,
+        "goodput_rps": (len(samples) - failed) / args.duration,
+        "error_rate": failed / len(samples) if samples else 0.0,
+        "errors": errors,
+        "latency": percentiles([latency for latency, error in samples if not error] or latencies),
+        "drain_s": time.perf_counter() - window_end,
+    }
+
+
+async def ramp(url, args, server_pid=None):
+    conversations = load_conversations(args.conversations)
+    mix = parse_mix(args.history_mix)
+    rng = random.Random(args.seed)
+    users = [VirtualUser(number, conversations, mix, random.Random(rng.random())) for number in range(max(args.concurrency))]
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    levels = []
+    async with httpx.AsyncClient(limits=limits) as client:
+        for concurrency in args.concurrency:
+            level = await run_level(client, url, concurrency, users, args)
+            if server_pid is not None:
+                level["server_rss_kib"] = server_rss_kib(server_pid)
+            levels.append(level)
+            print_level(level)
+            p99 = level["latency"].get("p99_ms", 0) / 1000
+            if (args.max_p99 and p99 > args.max_p99) or level["error_rate"] > args.max_error_rate:
+                print(f"stopping ramp: p99 {p99:.2f}s, error rate {level['error_rate']:.1%}")
+                break
+    return levels
+
+
+def print_level(level):
+    latency = level["latency"]
+    if not latency["count"]:
+        print(f"{level['concurrency']:5d} users  no requests completed in the window")
+        return
+    print(
+        f"{level['concurrency']:5d} users  {level['throughput_rps']:7.2f} req/s  "
+        f"p50 {latency['p50_ms']:8.1f} ms  p90 {latency['p90_ms']:8.1f} ms  p99 {latency['p99_ms']:8.1f} ms  "
+        f"errors {level['error_rate']:6.1%}"
+    )
+
+
+def sustainable(levels, args):
+    """Highest concurrency whose p99 and error rate stayed within the limits."""
+    best = None
+    for level in levels:
+        p99 = level["latency"].get("p99_ms", float("inf")) / 1000
+        if (not args.max_p99 or p99 <= args.max_p99) and level["error_rate"] <= args.max_error_rate:
+            best = level["concurrency"]
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["main", "langraph"], default="main")
+    parser.add_argument("--url", help="test a running service instead of starting one offline")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="comma-separated ramp of virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds at the start of each level")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between turns (exponential)")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-request timeout in seconds")
+    parser.add_argument("--history-mix", default="server=0.6,client=0.2,fresh=0.2")
+    parser.add_argument("--conversations", default=DEFAULT_CONVERSATIONS)
+    parser.add_argument("--max-p99", type=float, default=0.0, help="stop the ramp above this p99 (seconds)")
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD, help="agent scripts for the mock LLM")
+    parser.add_argument("--latency", action="append", default=[], metavar="STAGE=SPEC", help="mock LLM latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of mock LLM calls answered with 429")
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="config.ini override")
+    parser.add_argument("--startup-timeout", type=float, default=120.0)
+    parser.add_argument("--workdir")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results JSON here")
+    args = parser.parse_args()
+    args.concurrency = [int(value) for value in args.concurrency.split(",")]
+    args.workload = os.path.abspath(args.workload)
+
+    service = None
+    try:
+        if args.url:
+            url, server_pid = args.url.rstrip("/"), None
+        else:
+            service = LocalService(args.app, args).start()
+            url, server_pid = service.url, service.server.pid
+        print(f"target: {url}")
+        levels = asyncio.run(ramp(url, args, server_pid))
+    finally:
+        if service is not None:
+            service.stop()
+
+    result = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git": git_revision(),
+            "target": args.url or f"offline {args.app}",
+            "options": {key: value for key, value in vars(args).items() if key != "output"},
+        },
+        "levels": levels,
+        "sustainable_concurrency": sustainable(levels, args),
+        "mock": service.mock_stats if service is not None else None,
+    }
+    print(f"sustainable concurrency: {result['sustainable_concurrency']}")
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
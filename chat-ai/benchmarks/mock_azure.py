@@ -0,0 +1,404 @@
+"""
+Local stand-in for the Azure OpenAI chat-completions and embeddings endpoints.
+
+Serves any `.../chat/completions` and `.../embeddings` path, so it can be
+used as `azure_llm_gpt4_url` (the shared `AzureChatClient`) and as the
+endpoint of the LangChain SQL agent model. Each chat call is attributed to a
+stage by its system prompt (see `prompt_registry`) or, for the SQL agent, by
+the presence of `tools`:
+
+  guardrail        - "Safe" / "0", or the unsafe verdict for registered inputs
+  rephraser        - the `user_input` unchanged, followed by <stop>
+  template_answer  - a fixed one-line answer
+  sql_agent        - scripted tool calls, one per turn, then the final answer
+
+Agent scripts are keyed on the normalized question and are lists of steps,
+`{"tool": "sql_db_query", "args": {"query": "..."}}` or `{"answer": "..."}`;
+the turn is the number of tool results already in the conversation, so the
+server keeps no per-conversation state. Streaming (`"stream": true`) requests
+get OpenAI-style SSE chunks, including usage when `stream_options` asks for it.
+
+Latency is sampled per stage from `fixed:S`, `uniform:LOW,HIGH`,
+`normal:MEAN,STDEV` or `lognormal:MEDIAN,SIGMA` (seconds), and a share of
+calls can be answered with 429 + Retry-After.
+
+    python benchmarks/mock_azure.py --port 8600 --latency sql_agent=lognormal:0.8,0.4 --rate-limit 0.02
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_registry import GUARDRAIL, GUARDRAIL_BINARY, REPHRASER, TEMPLATE_ANSWER
+from token_counter import count_tokens
+
+DEFAULT_LATENCY = {
+    "guardrail": "lognormal:0.35,0.3",
+    "rephraser": "lognormal:0.45,0.3",
+    "template_answer": "lognormal:0.4,0.3",
+    "sql_agent": "lognormal:0.9,0.35",
+    "embeddings": "lognormal:0.08,0.3",
+    "other": "lognormal:0.4,0.3",
+}
+
+DEFAULT_SCRIPT = [
+    {"tool": "sql_db_query", "args": {"query": "SELECT country, COUNT(*) AS total FROM employees GROUP BY country"}},
+    {"answer": "The requested information is available in the employee records for each LATAM country."},
+]
+
+TEMPLATE_ANSWER_TEXT = "Here is the information you requested, based on the matching records."
+
+_USER_INPUT = re.compile(r"user_input:\s*(.*?)\s*\n\s*old_chat:", re.S)
+
+
+def chat_url(base_url, deployment="gpt-4", api_version="2023-03-15-preview"):
+    return f"{base_url}/openai/deployments/{deployment}/chat/completions?api-version={api_version}"
+
+
+def embeddings_url(base_url, deployment="text-embedding-ada-002", api_version="2023-03-15-preview"):
+    return f"{base_url}/openai/deployments/{deployment}/embeddings?api-version={api_version}"
+
+
+def normalize_question(text):
+    return " ".join(re.sub(r"[^a-z0-9\s]", " ", str(text).lower()).split())
+
+
+class Latency:
+    """A latency distribution parsed from `kind:params`; `sample()` returns seconds."""
+
+    def __init__(self, spec, rng):
+        self.spec = spec
+        self.rng = rng
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(param) for param in params.split(",") if param]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(self.params) != expected[kind]:
+            raise ValueError(f"bad latency spec {spec!r}; use fixed:S, uniform:LOW,HIGH, normal:MEAN,STDEV or lognormal:MEDIAN,SIGMA")
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, self.rng.gauss(*self.params))
+        median, sigma = self.params
+        return self.rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+def parse_latencies(specs, rng):
+    """`["stage=spec", ...]` on top of `DEFAULT_LATENCY`; `all=spec` sets every stage."""
+    latencies = dict(DEFAULT_LATENCY)
+    for item in specs or ():
+        stage, _, spec = item.partition("=")
+        if stage == "all":
+            latencies = {name: spec for name in latencies}
+        else:
+            latencies[stage] = spec
+    return {stage: Latency(spec, rng) for stage, spec in latencies.items()}
+
+
+def _message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+class MockAzureOpenAI:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency=None,
+        rate_limit=0.0,
+        retry_after=0.2,
+        scripts=None,
+        unsafe=(),
+        embedding_dimensions=1536,
+        seed=0,
+    ):
+        self.rng = random.Random(seed)
+        self.latency = parse_latencies(latency, self.rng)
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.scripts = {normalize_question(question): steps for question, steps in (scripts or {}).items()}
+        self.unsafe = {normalize_question(text) for text in unsafe}
+        self.embedding_dimensions = embedding_dimensions
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "rate_limited": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def chat_url(self):
+        return chat_url(self.base_url)
+
+    def embeddings_url(self):
+        return embeddings_url(self.base_url)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-azure-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return {stage: dict(entry) for stage, entry in self._stats.items()}
+
+    def _count(self, stage, **values):
+        with self._lock:
+            entry = self._stats[stage]
+            for key, value in values.items():
+                entry[key] += value
+
+    def _sleep(self, stage):
+        with self._lock:
+            delay = self.latency.get(stage, self.latency["other"]).sample()
+            limited = self.rate_limit > 0 and self.rng.random() < self.rate_limit
+        time.sleep(delay)
+        return limited
+
+    # --- Chat completions -------------------------------------------------------------
+
+    def stage_of(self, payload):
+        if payload.get("tools"):
+            return "sql_agent"
+        messages = payload.get("messages") or []
+        system = _message_text(messages[0]) if messages and messages[0].get("role") == "system" else ""
+        if system in (GUARDRAIL.system, GUARDRAIL_BINARY.system):
+            return "guardrail"
+        if system == REPHRASER.system:
+            return "rephraser"
+        if system == TEMPLATE_ANSWER.system:
+            return "template_answer"
+        return "other"
+
+    def reply(self, stage, payload):
+        """The assistant message `(content, tool_calls)` for a chat request."""
+        messages = payload.get("messages") or []
+        last_user = next((_message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+        if stage == "guardrail":
+            binary = _message_text(messages[0]) == GUARDRAIL_BINARY.system
+            unsafe = any(text in normalize_question(last_user) for text in self.unsafe)
+            return ("1" if unsafe else "0") if binary else ("Unsafe" if unsafe else "Safe"), []
+        if stage == "rephraser":
+            match = _USER_INPUT.search(last_user)
+            return f"{match.group(1) if match else last_user}<stop>", []
+        if stage == "template_answer":
+            return TEMPLATE_ANSWER_TEXT, []
+        if stage == "sql_agent":
+            question = next((_message_text(m) for m in messages if m.get("role") == "user"), "")
+            steps = self.scripts.get(normalize_question(question), DEFAULT_SCRIPT)
+            turn = sum(1 for m in messages if m.get("role") == "tool")
+            step = steps[turn] if turn < len(steps) else steps[-1]
+            if "tool" in step and turn < len(steps):
+                call = {
+                    "id": f"call_{uuid.uuid4().hex[:24]}",
+                    "type": "function",
+                    "function": {"name": step["tool"], "arguments": json.dumps(step.get("args", {}))},
+                }
+                return "", [call]
+            return step.get("answer", DEFAULT_SCRIPT[-1]["answer"]), []
+        return "OK", []
+
+    def completion(self, payload):
+        """`(stage, prompt_tokens, completion_tokens, content, tool_calls)` for a chat request."""
+        stage = self.stage_of(payload)
+        content, tool_calls = self.reply(stage, payload)
+        prompt_tokens = sum(count_tokens(_message_text(m)) + 4 for m in payload.get("messages") or [])
+        prompt_tokens += count_tokens(json.dumps(payload.get("tools"))) if payload.get("tools") else 0
+        completion_tokens = count_tokens(content) + sum(
+            count_tokens(call["function"]["arguments"]) + 4 for call in tool_calls
+        )
+        return stage, prompt_tokens, completion_tokens, content, tool_calls
+
+    def embedding(self, text, dimensions=None):
+        """Deterministic unit vector per text, so identical inputs embed identically."""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        vector = [rng.gauss(0, 1) for _ in range(dimensions or self.embedding_dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _rate_limited(self, stage):
+                mock._count(stage, rate_limited=1)
+                self._send_json(
+                    429,
+                    {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit (mock)."}},
+                    {"Retry-After": str(mock.retry_after), "retry-after-ms": str(int(mock.retry_after * 1000))},
+                )
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._send_json(400, {"error": {"code": "400", "message": "invalid JSON body"}})
+                    return
+                if urlsplit(self.path).path.rstrip("/").endswith("/embeddings"):
+                    self._embeddings(payload)
+                else:
+                    self._chat(payload)
+
+            def _embeddings(self, payload):
+                if mock._sleep("embeddings"):
+                    self._rate_limited("embeddings")
+                    return
+                texts = payload.get("input") or []
+                texts = [texts] if isinstance(texts, str) else texts
+                tokens = sum(count_tokens(str(text)) for text in texts)
+                mock._count("embeddings", calls=1, prompt_tokens=tokens)
+                self._send_json(200, {
+                    "object": "list",
+                    "data": [
+                        {"object": "embedding", "index": i, "embedding": mock.embedding(str(text), payload.get("dimensions"))}
+                        for i, text in enumerate(texts)
+                    ],
+                    "model": "text-embedding-ada-002",
+                    "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+                })
+
+            def _chat(self, payload):
+                stage, prompt_tokens, completion_tokens, content, tool_calls = mock.completion(payload)
+                if mock._sleep(stage):
+                    self._rate_limited(stage)
+                    return
+                mock._count(stage, calls=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }
+                finish_reason = "tool_calls" if tool_calls else "stop"
+                base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()), "model": "gpt-4"}
+                if payload.get("stream"):
+                    include_usage = (payload.get("stream_options") or {}).get("include_usage")
+                    self._stream(base, content, tool_calls, finish_reason, usage if include_usage else None)
+                    return
+                message = {"role": "assistant", "content": content or None}
+                if tool_calls:
+                    message["tool_calls"] = tool_calls
+                self._send_json(200, {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                    "usage": usage,
+                })
+
+            def _stream(self, base, content, tool_calls, finish_reason, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+
+                def chunk(choices, **extra):
+                    data = {**base, "object": "chat.completion.chunk", "choices": choices, **extra}
+                    self.wfile.write(f"data: {json.dumps(data)}\n\n".encode("utf-8"))
+
+                chunk([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+                for word in re.findall(r"\S+\s*", content):
+                    chunk([{"index": 0, "delta": {"content": word}, "finish_reason": None}])
+                for index, call in enumerate(tool_calls):
+                    chunk([{"index": 0, "delta": {"tool_calls": [{"index": index, **call}]}, "finish_reason": None}])
+                chunk([{"index": 0, "delta": {}, "finish_reason": finish_reason}])
+                if usage is not None:
+                    chunk([], usage=usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def load_scripts(path):
+    """Agent scripts and unsafe inputs from a workload JSONL file (see bench_pipeline.py)."""
+    scripts, unsafe = {}, []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("agent"):
+                scripts[item["question"]] = item["agent"]
+            if item.get("unsafe"):
+                unsafe.append(item["question"])
+    return scripts, unsafe
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--latency", action="append", default=[], metavar="STAGE=SPEC")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of calls answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--workload", help="workload JSONL providing agent scripts and unsafe inputs")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    scripts, unsafe = load_scripts(args.workload) if args.workload else ({}, [])
+    mock = MockAzureOpenAI(
+        args.host, args.port, args.latency, args.rate_limit, args.retry_after, scripts, unsafe, seed=args.seed
+    )
+    print(f"chat url:       {mock.chat_url()}")
+    print(f"embeddings url: {mock.embeddings_url()}")
+    try:
+        mock._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(mock.stats(), indent=2))
+        mock._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Synthetic stand-in for `cs_latam.db` used by the offline benchmarks.
+
+Builds a deterministic SQLite database of employees, policies and benefit
+enrolments across the LATAM countries, sized by `--employees`, so the SQL
+tools, governor and schema catalog run against realistic row counts without
+the production file.
+
+    python benchmarks/synthetic_db.py --output /tmp/cs_latam.db --employees 20000
+"""
+import argparse
+import os
+import random
+import sqlite3
+from datetime import date, timedelta
+
+COUNTRIES = [
+    "Argentina", "Brazil", "Chile", "Colombia", "Costa Rica", "Ecuador", "Guatemala",
+    "Mexico", "Panama", "Peru", "Puerto Rico", "Uruguay",
+]
+DEPARTMENTS = ["Finance", "Human Resources", "IT", "Legal", "Marketing", "Operations", "Research", "Sales", "Supply Chain"]
+JOB_LEVELS = ["Associate", "Analyst", "Senior Analyst", "Manager", "Senior Manager", "Director"]
+POLICY_TYPES = ["vacation", "parental leave", "remote work", "travel", "overtime", "sick leave"]
+BENEFITS = ["health insurance", "dental", "life insurance", "pension", "meal vouchers", "gym"]
+
+SCHEMA = """
+CREATE TABLE employees (
+    employee_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    country TEXT NOT NULL,
+    department TEXT NOT NULL,
+    job_level TEXT NOT NULL,
+    hire_date TEXT NOT NULL,
+    salary REAL NOT NULL
+);
+CREATE TABLE policies (
+    policy_id INTEGER PRIMARY KEY,
+    policy_name TEXT NOT NULL,
+    policy_type TEXT NOT NULL,
+    country TEXT NOT NULL,
+    description TEXT NOT NULL,
+    effective_date TEXT NOT NULL
+);
+CREATE TABLE benefit_enrollments (
+    enrollment_id INTEGER PRIMARY KEY,
+    employee_id INTEGER NOT NULL REFERENCES employees(employee_id),
+    benefit TEXT NOT NULL,
+    enrolled_on TEXT NOT NULL
+);
+"""
+
+
+def build(path, employees=5000, seed=0):
+    """Create `path` (replacing any existing file) and return its row counts per table."""
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript(SCHEMA)
+        start = date(2005, 1, 1)
+        conn.executemany(
+            "INSERT INTO employees VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    employee_id,
+                    f"Employee {employee_id}",
+                    rng.choice(COUNTRIES),
+                    rng.choice(DEPARTMENTS),
+                    rng.choice(JOB_LEVELS),
+                    (start + timedelta(days=rng.randrange(7300))).isoformat(),
+                    round(rng.lognormvariate(10.5, 0.5), 2),
+                )
+                for employee_id in range(1, employees + 1)
+            ),
+        )
+        policies = [
+            (
+                f"{country} {policy_type.title()} Policy",
+                policy_type,
+                country,
+                f"{policy_type.capitalize()} rules for employees based in {country}: "
+                f"{rng.randint(5, 30)} days per year, approved by the line manager.",
+                (start + timedelta(days=rng.randrange(7300))).isoformat(),
+            )
+            for country in COUNTRIES
+            for policy_type in POLICY_TYPES
+            if rng.random() < 0.85
+        ]
+        conn.executemany(
+            "INSERT INTO policies (policy_name, policy_type, country, description, effective_date) VALUES (?, ?, ?, ?, ?)",
+            policies,
+        )
+        conn.executemany(
+            "INSERT INTO benefit_enrollments (employee_id, benefit, enrolled_on) VALUES (?, ?, ?)",
+            (
+                (employee_id, benefit, (start + timedelta(days=rng.randrange(7300))).isoformat())
+                for employee_id in range(1, employees + 1)
+                for benefit in rng.sample(BENEFITS, rng.randint(1, 4))
+            ),
+        )
+        conn.commit()
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("employees", "policies", "benefit_enrollments")
+        }
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="cs_latam.db")
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(f"{args.output}: {build(args.output, args.employees, args.seed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Durable checkpointer for the LangGraph workflow.
+
+`DurableCheckpointer` is an `AsyncSqliteSaver` on a file in WAL mode, so every
+uvicorn worker on the host can share it and conversation state survives a
+rolling restart. Checkpoints are serialized with the default msgpack
+(ormsgpack) serde and zstd-compressed by `ZstdSerializer`.
+
+Retention is enforced by `compact()`, normally run from a background task
+(`run_compaction`):
+  * age   - threads whose newest checkpoint is older than `max_age` seconds
+            are deleted (checkpoint ids are time-ordered uuid6 strings, so a
+            cutoff id can be compared directly in SQL)
+  * count - only the newest `max_per_thread` checkpoints of each thread are
+            kept
+Pending writes of deleted checkpoints go with them.
+"""
+import asyncio
+import logging
+import time
+
+import aiosqlite
+import zstandard
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+logger = logging.getLogger("uvicorn")
+
+# 100ns intervals between the Gregorian epoch (uuid v1/v6) and the Unix epoch.
+_UUID_EPOCH_OFFSET = 0x01B21DD213814000
+
+
+class ZstdSerializer(SerializerProtocol):
+    """Serializer that zstd-compresses the bytes of another serializer; small payloads are stored as-is."""
+
+    def __init__(self, serde=None, level=3, min_size=256):
+        self.serde = serde or JsonPlusSerializer()
+        self.level = level
+        self.min_size = min_size
+
+    def dumps_typed(self, obj):
+        typ, data = self.serde.dumps_typed(obj)
+        if len(data) < self.min_size:
+            return typ, data
+        # Compressor objects are not thread-safe; the saver's sync API runs on worker threads.
+        return f"{typ}+zstd", zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def loads_typed(self, data):
+        typ, payload = data
+        if not typ.endswith("+zstd"):
+            return self.serde.loads_typed(data)
+        return self.serde.loads_typed((typ[: -len("+zstd")], zstandard.ZstdDecompressor().decompress(payload)))
+
+
+def checkpoint_id_before(timestamp):
+    """Smallest uuid6 checkpoint id generated at `timestamp`; older ids sort below it."""
+    ticks = f"{int(timestamp * 10_000_000) + _UUID_EPOCH_OFFSET:015x}"
+    return f"{ticks[:8]}-{ticks[8:12]}-6{ticks[12:15]}-0000-000000000000"
+
+
+class DurableCheckpointer(AsyncSqliteSaver):
+    def __init__(self, conn, *, max_age=None, max_per_thread=None, serde=None):
+        super().__init__(conn, serde=serde)
+        self.max_age = max_age
+        self.max_per_thread = max_per_thread
+        self.compactions = 0
+        self.deleted_checkpoints = 0
+
+    @classmethod
+    async def open(cls, path, *, max_age=None, max_per_thread=None, compression_level=3, busy_timeout=30.0):
+        """Connect to `path` (created if missing) and create the checkpoint tables."""
+        conn = await aiosqlite.connect(path, timeout=busy_timeout)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        saver = cls(
+            conn,
+            max_age=max_age,
+            max_per_thread=max_per_thread,
+            serde=ZstdSerializer(level=compression_level),
+        )
+        await saver.setup()
+        return saver
+
+    @classmethod
+    async def from_config(cls, section):
+        """Open the checkpointer from `config.ini`; returns `None` when `checkpoint_path` is empty."""
+        path = section.get("checkpoint_path", fallback="")
+        if not path:
+            return None
+        return await cls.open(
+            path,
+            max_age=section.getfloat("checkpoint_max_age", fallback=86400) or None,
+            max_per_thread=section.getint("checkpoint_max_per_thread", fallback=10) or None,
+            compression_level=section.getint("checkpoint_compression_level", fallback=3),
+        )
+
+    async def compact(self):
+        """Apply the age and count retention; returns the number of checkpoints deleted."""
+        await self.setup()
+        deleted = 0
+        async with self.lock:
+            if self.max_age:
+                cursor = await self.conn.execute(
+                    "DELETE FROM checkpoints WHERE thread_id IN ("
+                    "SELECT thread_id FROM checkpoints GROUP BY thread_id HAVING MAX(checkpoint_id) < ?)",
+                    (checkpoint_id_before(time.time() - self.max_age),),
+                )
+                deleted += cursor.rowcount
+            if self.max_per_thread:
+                cursor = await self.conn.execute(
+                    "DELETE FROM checkpoints WHERE rowid IN ("
+                    "SELECT rowid FROM (SELECT rowid, ROW_NUMBER() OVER ("
+                    "PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS position "
+                    "FROM checkpoints) WHERE position > ?)",
+                    (self.max_per_thread,),
+                )
+                deleted += cursor.rowcount
+            await self.conn.execute(
+                "DELETE FROM writes WHERE NOT EXISTS (SELECT 1 FROM checkpoints c WHERE "
+                "c.thread_id = writes.thread_id AND c.checkpoint_ns = writes.checkpoint_ns "
+                "AND c.checkpoint_id = writes.checkpoint_id)"
+            )
+            await self.conn.commit()
+            # Fold the WAL back into the main file so it does not grow between restarts.
+            await self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compactions += 1
+        self.deleted_checkpoints += deleted
+        return deleted
+
+    async def run_compaction(self, interval):
+        """Background loop for the FastAPI lifespan; cancel the task to stop it."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                deleted = await self.compact()
+                if deleted:
+                    logger.info(f"Checkpoint compaction removed {deleted} checkpoints")
+            except Exception as e:
+                logger.warning(f"Checkpoint compaction failed: {e}")
+
+    async def aclose(self):
+        await self.conn.close()
+
+    def stats(self):
+        return {
+            "compactions": self.compactions,
+            "deleted_checkpoints": self.deleted_checkpoints,
+            "max_age": self.max_age,
+            "max_per_thread": self.max_per_thread,
+        }
@@ -0,0 +1,222 @@
+"""
+Per-conversation chat history.
+
+Replaces the process-global `chat_history` list: every conversation (UserID +
+session) gets its own history, and a request only ever sees its own last
+`max_turns` question/answer pairs. Turns trimmed from the window are passed
+to `fold` (see `HistoryWindow.fold`) and kept as a rolling summary.
+
+Two tiers:
+  * memory - bounded LRU of recent conversations; entries expire after
+             `idle_ttl` seconds without a read or write
+  * disk   - optional SQLite table (via aiosqlite, WAL mode) so that all
+             uvicorn workers on the host share the same histories
+
+The memory tier is dropped whenever `PRAGMA data_version` shows another
+connection (i.e. another worker) has committed to the database.
+"""
+import asyncio
+import logging
+import time
+import weakref
+
+from ttl_cache import TTLCache
+
+try:
+    import aiosqlite
+except ImportError:  # pragma: no cover - optional dependency
+    aiosqlite = None
+
+logger = logging.getLogger("uvicorn")
+
+
+def conversation_key(parameters):
+    """Same `UserID` + `request_id` pairing `main_langraph.py` uses for checkpointer threads."""
+    user_id = parameters.get("UserID") or parameters.get("request_id") or "default_user"
+    session_id = parameters.get("session_id") or parameters.get("request_id") or "default_request"
+    return f"{user_id}_{session_id}"
+
+
+class ConversationStore:
+    def __init__(self, maxsize=1024, idle_ttl=1800, max_turns=4, disk_path=None, fold=None):
+        self.max_turns = max_turns
+        self.fold = fold
+        self.idle_ttl = idle_ttl
+        self.disk_path = disk_path
+        self.memory = TTLCache(maxsize=maxsize, ttl=idle_ttl)
+        self.disk_reads = 0
+        self._locks = weakref.WeakValueDictionary()
+        self._disk = None
+        self._disk_init = asyncio.Lock()
+        self._data_version = None
+        self._writes = 0
+
+    @classmethod
+    def from_config(cls, section, fold=None):
+        idle_ttl = section.getfloat("conversation_idle_ttl", fallback=1800)
+        return cls(
+            maxsize=section.getint("conversation_store_size", fallback=1024),
+            idle_ttl=idle_ttl or None,
+            max_turns=section.getint("conversation_max_turns", fallback=4),
+            disk_path=section.get("conversation_store_path", fallback="") or None,
+            fold=fold,
+        )
+
+    def lock(self, key):
+        """Per-conversation lock; released locks are garbage collected with their last waiter."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    async def _connection(self):
+        if self.disk_path is None:
+            return None
+        if self._disk is not None:
+            return self._disk
+        if aiosqlite is None:
+            logger.warning("aiosqlite is not installed; conversation store is memory only")
+            self.disk_path = None
+            return None
+        async with self._disk_init:
+            if self._disk is None:
+                conn = await aiosqlite.connect(self.disk_path, timeout=5)
+                await conn.execute("PRAGMA journal_mode=WAL")
+                await conn.execute("PRAGMA synchronous=NORMAL")
+                await conn.execute(
+                    "CREATE TABLE IF NOT EXISTS conversation_turns ("
+                    "seq INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, "
+                    "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+                )
+                await conn.execute(
+                    "CREATE INDEX IF NOT EXISTS conversation_turns_id ON conversation_turns(conversation_id, seq)"
+                )
+                await conn.execute(
+                    "CREATE TABLE IF NOT EXISTS conversation_summaries ("
+                    "conversation_id TEXT PRIMARY KEY, summary TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+                await conn.commit()
+                self._disk = conn
+        return self._disk
+
+    async def _sync_memory(self, conn):
+        async with conn.execute("PRAGMA data_version") as cursor:
+            (data_version,) = await cursor.fetchone()
+        if data_version != self._data_version:
+            if self._data_version is not None:
+                self.memory.clear()
+            self._data_version = data_version
+
+    async def _load(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+        conn = await self._connection()
+        summary, history = "", []
+        if conn is not None:
+            self.disk_reads += 1
+            async with conn.execute(
+                "SELECT role, content FROM conversation_turns WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?",
+                (key, self.max_turns * 2),
+            ) as cursor:
+                rows = await cursor.fetchall()
+            history = [{"role": role, "content": content} for role, content in reversed(rows)]
+            async with conn.execute(
+                "SELECT summary FROM conversation_summaries WHERE conversation_id = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            summary = row[0] if row else ""
+        return summary, history
+
+    async def conversation(self, key):
+        """`(summary, turns)`: the rolling summary and the last `max_turns` pairs, oldest first."""
+        async with self.lock(key):
+            conn = await self._connection()
+            if conn is not None:
+                await self._sync_memory(conn)
+            summary, history = await self._load(key)
+            # Re-set to restart the idle timer.
+            self.memory.set(key, (summary, history))
+            return summary, list(history)
+
+    async def history(self, key):
+        """Last `max_turns` user/assistant pairs of the conversation, oldest first."""
+        return (await self.conversation(key))[1]
+
+    async def append(self, key, user, assistant):
+        turn = [{"role": "user", "content": user}, {"role": "assistant", "content": assistant}]
+        async with self.lock(key):
+            conn = await self._connection()
+            if conn is not None:
+                await self._sync_memory(conn)
+            summary, history = await self._load(key)
+            history = history + turn
+            overflow, history = history[:-self.max_turns * 2], history[-self.max_turns * 2:]
+            if overflow and self.fold is not None:
+                summary = self.fold(summary, overflow)
+            self.memory.set(key, (summary, history))
+            if conn is None:
+                return
+            now = time.time()
+            if overflow and self.fold is not None:
+                await conn.execute(
+                    "INSERT OR REPLACE INTO conversation_summaries(conversation_id, summary, updated_at) "
+                    "VALUES (?, ?, ?)",
+                    (key, summary, now),
+                )
+            await conn.executemany(
+                "INSERT INTO conversation_turns(conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                [(key, msg["role"], msg["content"], now) for msg in turn],
+            )
+            await conn.execute(
+                "DELETE FROM conversation_turns WHERE conversation_id = ? AND seq NOT IN ("
+                "SELECT seq FROM conversation_turns WHERE conversation_id = ? ORDER BY seq DESC LIMIT ?)",
+                (key, key, self.max_turns * 2),
+            )
+            await conn.commit()
+            self._writes += 1
+        if self.idle_ttl and self._writes % 100 == 0:
+            await self.purge_idle()
+
+    async def clear(self, key):
+        async with self.lock(key):
+            self.memory.pop(key)
+            conn = await self._connection()
+            if conn is not None:
+                await conn.execute("DELETE FROM conversation_turns WHERE conversation_id = ?", (key,))
+                await conn.execute("DELETE FROM conversation_summaries WHERE conversation_id = ?", (key,))
+                await conn.commit()
+
+    async def purge_idle(self):
+        """Delete on-disk conversations idle for longer than `idle_ttl`."""
+        conn = await self._connection()
+        if conn is None or not self.idle_ttl:
+            return 0
+        cutoff = time.time() - self.idle_ttl
+        cursor = await conn.execute(
+            "DELETE FROM conversation_turns WHERE conversation_id IN ("
+            "SELECT conversation_id FROM conversation_turns GROUP BY conversation_id HAVING MAX(created_at) < ?)",
+            (cutoff,),
+        )
+        await conn.execute(
+            "DELETE FROM conversation_summaries WHERE updated_at < ? AND conversation_id NOT IN ("
+            "SELECT DISTINCT conversation_id FROM conversation_turns)",
+            (cutoff,),
+        )
+        await conn.commit()
+        return cursor.rowcount
+
+    async def aclose(self):
+        if self._disk is not None:
+            await self._disk.close()
+            self._disk = None
+
+    def stats(self):
+        return {
+            "size": len(self.memory),
+            "memory_hits": self.memory.hits,
+            "memory_misses": self.memory.misses,
+            "disk_reads": self.disk_reads,
+            "disk_enabled": self.disk_path is not None,
+        }
@@ -0,0 +1,113 @@
+"""
+Read-only connection pool for `cs_latam.db`.
+
+The SQL agent only ever reads, so every connection is opened through a
+`file:...?mode=ro` URI (optionally `immutable=1`) with `query_only` set, and
+tuned with `mmap_size` / `cache_size`. Connections come from a SQLAlchemy
+`QueuePool` rather than one shared handle. Each thread that runs a tool call
+checks out its own connection, so concurrent SQL tool calls run in parallel
+instead of serializing on (or corrupting) a single connection.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import urllib.parse
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("uvicorn")
+
+
+def readonly_uri(db_path, immutable=False):
+    """`file:` URI that opens `db_path` read-only; `immutable` also skips locking and change detection."""
+    path = urllib.parse.quote(os.path.abspath(db_path))
+    return f"file:{path}?mode=ro" + ("&immutable=1" if immutable else "")
+
+
+class ReadOnlySQLitePool:
+    def __init__(
+        self,
+        db_path,
+        *,
+        pool_size=8,
+        max_overflow=8,
+        pool_timeout=10.0,
+        immutable=False,
+        mmap_size=256 * 1024 * 1024,
+        cache_size_kib=16 * 1024,
+    ):
+        self.db_path = db_path
+        self.uri = readonly_uri(db_path, immutable)
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.connects = 0
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self._lock = threading.Lock()
+        self.engine = create_engine(
+            "sqlite://",
+            creator=self._connect,
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_pre_ping=False,
+        )
+        event.listen(self.engine, "checkout", self._on_checkout)
+        event.listen(self.engine, "checkin", self._on_checkin)
+
+    @classmethod
+    def from_config(cls, section, db_path):
+        return cls(
+            db_path,
+            pool_size=section.getint("db_pool_size", fallback=8),
+            max_overflow=section.getint("db_pool_max_overflow", fallback=8),
+            pool_timeout=section.getfloat("db_pool_timeout", fallback=10.0),
+            immutable=section.getboolean("db_immutable", fallback=False),
+            mmap_size=section.getint("db_mmap_size", fallback=256 * 1024 * 1024),
+            cache_size_kib=section.getint("db_cache_size_kib", fallback=16 * 1024),
+        )
+
+    def _connect(self):
+        # Connections move between the threads that check them out; the pool guarantees exclusive use.
+        conn = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        with self._lock:
+            self.connects += 1
+        return conn
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.in_use -= 1
+
+    def database(self, **kwargs):
+        """`SQLDatabase` for `SQLDatabaseToolkit`, backed by this pool."""
+        return SQLDatabase(self.engine, **kwargs)
+
+    def dispose(self):
+        self.engine.dispose()
+
+    def stats(self):
+        pool = self.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+        }
@@ -0,0 +1,140 @@
+"""
+Cache for guardrail verdicts.
+
+The guardrail prompt is deterministic enough (temperature 0.1, one-word
+answer) that the same prompt version + messages always gets the same
+verdict. Verdicts are kept in a bounded in-process LRU, optionally backed by
+an on-disk SQLite table shared by all workers on the host. Disk reads and
+writes run in a worker thread so they never block the event loop, and the
+table is trimmed to `guardrail_cache_disk_size` rows (and the TTL) as it grows.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger("uvicorn")
+
+
+class GuardrailCache:
+    # Trim the disk table once every this many writes rather than on each one.
+    TRIM_EVERY = 256
+
+    def __init__(self, maxsize=4096, ttl=None, disk_path=None, disk_maxsize=100000):
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.disk_path = disk_path
+        self.disk_maxsize = disk_maxsize
+        self.disk_hits = 0
+        self.misses = 0
+        self.trimmed = 0
+        self._writes = 0
+        self._disk_lock = threading.Lock()
+        self._disk = self._open_disk(disk_path) if disk_path else None
+
+    @classmethod
+    def from_config(cls, section):
+        """Build the cache from `config.ini`; returns `None` when `guardrail_cache_enabled` is false."""
+        if not section.getboolean("guardrail_cache_enabled", fallback=True):
+            return None
+        ttl = section.getfloat("guardrail_cache_ttl", fallback=0)
+        return cls(
+            maxsize=section.getint("guardrail_cache_size", fallback=4096),
+            ttl=ttl or None,
+            disk_path=section.get("guardrail_cache_path", fallback="") or None,
+            disk_maxsize=section.getint("guardrail_cache_disk_size", fallback=100000),
+        )
+
+    @staticmethod
+    def _open_disk(path):
+        conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS guardrail_verdicts ("
+            "key TEXT PRIMARY KEY, verdict TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def key(prompt_version, messages):
+        """Hash of the prompt version and the exact messages sent to the model."""
+        payload = json.dumps([prompt_version, messages], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _disk_get(self, key):
+        try:
+            with self._disk_lock:
+                return self._disk.execute(
+                    "SELECT verdict, created_at FROM guardrail_verdicts WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Guardrail cache disk lookup failed: {e}")
+            return None
+
+    def _disk_set(self, key, verdict):
+        try:
+            with self._disk_lock:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO guardrail_verdicts(key, verdict, created_at) VALUES (?, ?, ?)",
+                    (key, verdict, time.time()),
+                )
+                self._writes += 1
+                if self._writes % self.TRIM_EVERY == 0:
+                    self._trim()
+                self._disk.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Guardrail cache disk write failed: {e}")
+
+    def _trim(self):
+        """Delete expired rows and the oldest rows beyond `disk_maxsize`; caller holds the lock."""
+        deleted = 0
+        if self.ttl:
+            deleted += self._disk.execute(
+                "DELETE FROM guardrail_verdicts WHERE created_at <= ?", (time.time() - self.ttl,)
+            ).rowcount
+        if self.disk_maxsize:
+            deleted += self._disk.execute(
+                "DELETE FROM guardrail_verdicts WHERE key IN ("
+                "SELECT key FROM guardrail_verdicts ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_maxsize,),
+            ).rowcount
+        self.trimmed += deleted
+
+    async def get(self, key):
+        verdict = self.memory.get(key)
+        if verdict is not None:
+            return verdict
+
+        if self._disk is not None:
+            row = await asyncio.to_thread(self._disk_get, key)
+            if row is not None and (not self.ttl or row[1] + self.ttl > time.time()):
+                self.disk_hits += 1
+                self.memory.set(key, row[0])
+                return row[0]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key, verdict):
+        self.memory.set(key, verdict)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk_set, key, verdict)
+
+    def stats(self):
+        memory_hits = self.memory.hits
+        total = memory_hits + self.disk_hits + self.misses
+        return {
+            "size": len(self.memory),
+            "memory_hits": memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "trimmed": self.trimmed,
+            "hit_rate": (memory_hits + self.disk_hits) / total if total else 0.0,
+        }
@@ -0,0 +1,113 @@
+"""
+Token-budgeted views of a conversation's history for each prompt stage.
+
+Every stage that splices history into its prompt gets its own budget and its
+own idea of which turns matter:
+  * guardrail - only the user's own turns; assistant answers are never needed
+  * rephraser - user and assistant turns plus the rolling summary
+
+Long assistant answers (SQL result narrations) are clipped to `answer_tokens`
+and the newest turns that fit the budget are kept. Turns that fall out of the
+window are not lost: `fold` appends a one-line digest of each to a rolling
+summary that is itself capped at `summary_tokens`, dropping its oldest lines
+first. `ConversationStore` calls `fold` when it trims a conversation, so the
+summary is updated incrementally rather than rebuilt per request.
+"""
+from dataclasses import dataclass
+
+from token_counter import count_tokens, truncate
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+
+@dataclass(frozen=True)
+class StageBudget:
+    tokens: int
+    roles: tuple = ("user", "assistant")
+    summary: bool = False
+
+
+DEFAULT_STAGES = {
+    "guardrail": StageBudget(tokens=300, roles=("user",)),
+    "rephraser": StageBudget(tokens=1200, summary=True),
+}
+
+
+class HistoryWindow:
+    def __init__(self, stages=None, answer_tokens=200, summary_tokens=300, digest_tokens=40):
+        self.stages = dict(DEFAULT_STAGES if stages is None else stages)
+        self.answer_tokens = answer_tokens
+        self.summary_tokens = summary_tokens
+        self.digest_tokens = digest_tokens
+
+    @classmethod
+    def from_config(cls, section):
+        stages = {
+            name: StageBudget(
+                tokens=section.getint(f"history_budget_{name}", fallback=budget.tokens),
+                roles=budget.roles,
+                summary=budget.summary,
+            )
+            for name, budget in DEFAULT_STAGES.items()
+        }
+        return cls(
+            stages,
+            answer_tokens=section.getint("history_answer_tokens", fallback=200),
+            summary_tokens=section.getint("history_summary_tokens", fallback=300),
+        )
+
+    def fold(self, summary, messages):
+        """Fold `messages` (oldest first) into the rolling `summary` and return the new summary."""
+        lines = [line for line in (summary or "").splitlines() if line]
+        question = None
+        for msg in messages:
+            content = " ".join((msg.get("content") or "").split())
+            if msg.get("role") == "user":
+                if question is not None:
+                    lines.append(f"- Q: {question}")
+                question = truncate(content, self.digest_tokens)
+            elif msg.get("role") == "assistant" and question is not None:
+                lines.append(f"- Q: {question} A: {truncate(content, self.digest_tokens)}")
+                question = None
+        if question is not None:
+            lines.append(f"- Q: {question}")
+
+        while lines and count_tokens("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return "\n".join(lines)
+
+    def _fit(self, messages, budget):
+        kept = []
+        used = 0
+        for msg in reversed(messages):
+            content = msg.get("content") or ""
+            if msg.get("role") == "assistant":
+                content = truncate(content, self.answer_tokens)
+            cost = count_tokens(content) + 4
+            if used + cost > budget:
+                break
+            kept.append({"role": msg["role"], "content": content})
+            used += cost
+        kept.reverse()
+        # Never start the window on an answer whose question was cut off.
+        while kept and kept[0]["role"] != "user":
+            kept.pop(0)
+        return kept, used
+
+    def window(self, stage, messages, summary=""):
+        """Messages for `stage`, oldest first, within its token budget; the summary leads when present."""
+        budget = self.stages[stage]
+        candidates = [msg for msg in messages or [] if msg.get("role") in budget.roles]
+        kept, _ = self._fit(candidates, budget.tokens)
+        if not budget.summary or (not summary and len(kept) == len(candidates)):
+            return kept
+
+        # Leave room for the summary, then fold whatever no longer fits into it.
+        reserve = self.summary_tokens + count_tokens(SUMMARY_PREFIX) + 4
+        kept, _ = self._fit(candidates, max(budget.tokens - reserve, 0))
+        dropped = candidates[: len(candidates) - len(kept)]
+        if dropped:
+            summary = self.fold(summary, dropped)
+        if summary:
+            kept.insert(0, {"role": "system", "content": f"{SUMMARY_PREFIX}\n{summary}"})
+        return kept
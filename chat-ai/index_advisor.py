@@ -0,0 +1,276 @@
+"""
+Offline index advisor for `cs_latam.db`, driven by the SQL query log.
+
+    python index_advisor.py --log sql_query_log.db --db cs_latam.db
+    python index_advisor.py --log sql_query_log.db --db cs_latam.db --apply cs_latam.advised.db
+
+Aggregates the successful statements in the query log (see `query_log.py`)
+and weights each by count x average time. Statements whose plan has a full
+table scan or a temporary B-tree sort get a candidate index per scanned
+table. The candidate's key columns are the equality, then range/ORDER BY/
+GROUP BY columns of that table. The remaining columns the statement reads
+are appended so the index covers it. On a scratch copy of the database
+each candidate is created in turn and every statement's plan is scored:
+fewer full scans, no temp B-tree, a covering lookup and more equality terms
+win. Each statement goes to the candidate that gives it the best plan (the
+wider index on a tie), and only candidates that beat the logged plan for at
+least one statement are proposed.
+
+With `--apply` the proposed indexes are created (and `ANALYZE` run) on a
+copy of the database at the given path. The logged workload is replayed
+against the copy before and after so the gain can be checked before the
+indexes go anywhere near production.
+"""
+import argparse
+import os
+import re
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from query_log import load_workload
+from sql_governor import scanned_table, table_aliases
+
+_TEMP_BTREE = "USE TEMP B-TREE"
+_CLAUSE_END = r"(?=\b(?:having|order\s+by|limit|union|except|intersect)\b|\)|$)"
+
+
+def copy_database(src_path, dst_path):
+    """Consistent copy of a live SQLite database (WAL included) via the backup API."""
+    src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+def costly_steps(sql, plan):
+    """`(tables fully scanned, has temp B-tree sort)` for a logged `(id, parent, detail)` plan."""
+    aliases = table_aliases(sql)
+    tables = []
+    temp_btree = False
+    for _, _, detail in plan:
+        table = scanned_table(detail, aliases)
+        if table and "COVERING INDEX" not in detail:
+            tables.append(table)
+        if detail.startswith(_TEMP_BTREE):
+            temp_btree = True
+    return tables, temp_btree
+
+
+def columns_read(conn, sql):
+    """`{table: [column, ...]}` read by `sql`, collected by an authorizer while it is prepared."""
+    reads = {}
+
+    def authorizer(action, table, column, db_name, trigger):
+        if action == sqlite3.SQLITE_READ and table and column and not table.startswith("sqlite_"):
+            columns = reads.setdefault(table, [])
+            if column not in columns:
+                columns.append(column)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(authorizer)
+    try:
+        conn.execute(f"EXPLAIN {sql}").fetchall()
+    finally:
+        conn.set_authorizer(None)
+    return reads
+
+
+def _clause_columns(sql, keyword, columns):
+    found = []
+    for clause in re.findall(rf"\b{keyword}\s+by\b(.*?){_CLAUSE_END}", sql, re.S):
+        for column in columns:
+            if re.search(rf"(?<![\w]){re.escape(column.lower())}\b", clause) and column not in found:
+                found.append(column)
+    return found
+
+
+def candidate_columns(sql, columns, max_columns=6):
+    """Key columns (equality, then range/group/order) followed by the rest of `columns` for coverage."""
+    sql = sql.lower()
+    equality, ranged = [], []
+    for column in columns:
+        name = re.escape(column.lower())
+        ref = rf"(?<![\w])(?:\w+\.)?\"?{name}\"?"
+        if re.search(rf"{ref}\s*(?:==?|\bin\b|\bis\b)", sql) or re.search(rf"==?\s*{ref}\b", sql):
+            equality.append(column)
+        elif re.search(rf"{ref}\s*(?:[<>]|\bbetween\b|\blike\b)", sql):
+            ranged.append(column)
+    ordered = [c for c in _clause_columns(sql, "group", columns) + _clause_columns(sql, "order", columns)
+               if c not in equality]
+    keys = equality + [c for c in ranged + ordered if c not in equality][:1]
+    if not keys:
+        return None
+    covering = keys + [c for c in columns if c not in keys]
+    return tuple(covering if len(covering) <= max_columns else keys)
+
+
+def index_name(table, columns):
+    name = "ix_advisor_" + "_".join([table] + list(columns))
+    return re.sub(r"\W", "_", name.lower())[:60]
+
+
+def index_ddl(table, columns, name=None):
+    cols = ", ".join('"' + c.replace('"', '""') + '"' for c in columns)
+    table_ref = '"' + table.replace('"', '""') + '"'
+    return f'CREATE INDEX IF NOT EXISTS "{name or index_name(table, columns)}" ON {table_ref} ({cols})'
+
+
+def propose(conn, workload, max_columns=6):
+    """Candidate `(table, columns)` -> statements it targets, for statements with costly plan steps."""
+    candidates = {}
+    for statement in workload:
+        scanned, temp_btree = costly_steps(statement["sql"], statement["plan"])
+        if not scanned and not temp_btree:
+            continue
+        try:
+            reads = columns_read(conn, statement["sql"])
+        except sqlite3.Error:
+            continue  # Schema changed since the query was logged.
+        reads = {table.lower(): (table, columns) for table, columns in reads.items()}
+        for key in scanned or list(reads):
+            if key not in reads:
+                continue
+            table, columns = reads[key]
+            columns = candidate_columns(statement["sql"], columns, max_columns)
+            if columns:
+                candidates.setdefault((table, columns), []).append(statement)
+    return candidates
+
+
+def _plan(conn, sql):
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+
+
+def plan_quality(sql, plan, name=None):
+    """
+    Sortable score of a plan, higher is better: fewer full scans, no temp B-tree,
+    then a covering lookup (through index `name`, if given) and more equality terms.
+    """
+    scanned, temp_btree = costly_steps(sql, plan)
+    covering = equality = 0
+    for _, _, detail in plan:
+        if (f"INDEX {name} " in f"{detail} ") if name else " INDEX " in detail:
+            covering = max(covering, int("COVERING INDEX" in detail))
+            equality = max(equality, len(re.findall(r"\w\"?=\?", detail)))
+    return -len(scanned), not temp_btree, covering, equality
+
+
+def evaluate(conn, candidates, workload, max_indexes=5):
+    """
+    Score every candidate by the plan it gives each statement and assign each
+    statement to the candidate with the best plan, ties going to the wider
+    index. Candidates are then kept greedily by the logged time they take on.
+    """
+    best = {}
+    for table, columns in candidates:
+        name = index_name(table, columns)
+        conn.execute(index_ddl(table, columns, name))
+        try:
+            for statement in workload:
+                plan = _plan(conn, statement["sql"])
+                if not any(f"INDEX {name} " in f"{detail} " for _, _, detail in plan):
+                    continue
+                quality = plan_quality(statement["sql"], plan, name)
+                if quality <= plan_quality(statement["sql"], statement["plan"]):
+                    continue  # Used, but no better than the logged plan.
+                key = (quality, len(columns))
+                current = best.get(statement["normalized"])
+                if current is None or key > current[0]:
+                    best[statement["normalized"]] = (key, (table, columns), statement)
+        finally:
+            conn.execute(f'DROP INDEX "{name}"')
+
+    helped = {}
+    for _, candidate, statement in best.values():
+        helped.setdefault(candidate, []).append(statement)
+    scored = [
+        (sum(s["count"] * s["avg_ms"] for s in statements), table, columns, statements)
+        for (table, columns), statements in helped.items()
+    ]
+    return [
+        {"table": table, "columns": columns, "weight_ms": weight, "statements": statements}
+        for weight, table, columns, statements in sorted(scored, key=lambda item: (-item[0], -len(item[2])))
+    ][:max_indexes]
+
+
+def replay(conn, workload, repeat=5):
+    """Median ms per statement and the count-weighted total for the logged workload."""
+    timings = {}
+    for statement in workload:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(statement["sql"]).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[statement["normalized"]] = statistics.median(samples)
+    total = sum(s["count"] * timings[s["normalized"]] for s in workload)
+    return timings, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default="sql_query_log.db", help="query log written by the service")
+    parser.add_argument("--db", default="cs_latam.db")
+    parser.add_argument("--apply", metavar="COPY", help="create the indexes on a copy of --db at this path")
+    parser.add_argument("--max-indexes", type=int, default=5)
+    parser.add_argument("--max-columns", type=int, default=6, help="widest covering index to propose")
+    parser.add_argument("--repeat", type=int, default=5, help="replays of each statement when benchmarking")
+    parser.add_argument("--top", type=int, default=15, help="statements to list in the reports")
+    args = parser.parse_args()
+
+    workload = load_workload(args.log)
+    if not workload:
+        print(f"No successful statements in {args.log}")
+        return
+    print(f"{len(workload)} distinct statements, {sum(s['count'] for s in workload)} executions\n")
+    print(f"{'count':>6} {'avg ms':>9} {'max ms':>9}  costly steps / statement")
+    for statement in workload[: args.top]:
+        scanned, temp_btree = costly_steps(statement["sql"], statement["plan"])
+        steps = ", ".join([f"SCAN {t}" for t in scanned] + (["TEMP B-TREE"] if temp_btree else [])) or "-"
+        print(f"{statement['count']:>6} {statement['avg_ms']:>9.2f} {statement['max_ms']:>9.2f}  {steps}")
+        print(f"{'':>27}{' '.join(statement['sql'].split())[:100]}")
+
+    if args.apply:
+        target = args.apply
+        copy_database(args.db, target)
+    else:
+        scratch = tempfile.mkdtemp(prefix="index_advisor_")
+        target = os.path.join(scratch, os.path.basename(args.db))
+        copy_database(args.db, target)
+    conn = sqlite3.connect(target)
+    try:
+        candidates = propose(conn, workload, args.max_columns)
+        accepted = evaluate(conn, candidates, workload, args.max_indexes)
+        print(f"\n{len(candidates)} candidate indexes, {len(accepted)} improve a logged plan:")
+        for index in accepted:
+            print(f"  {index_ddl(index['table'], index['columns'])};")
+            print(f"      helps {len(index['statements'])} statements, {index['weight_ms']:.1f} ms of logged time")
+        if not args.apply or not accepted:
+            return
+
+        before, before_total = replay(conn, workload, args.repeat)
+        for index in accepted:
+            conn.execute(index_ddl(index["table"], index["columns"]))
+        conn.execute("ANALYZE")
+        conn.commit()
+        after, after_total = replay(conn, workload, args.repeat)
+        print(f"\nWorkload replay on {target} (median of {args.repeat} runs, ms):")
+        print(f"{'count':>6} {'before':>9} {'after':>9}  statement")
+        for statement in workload[: args.top]:
+            key = statement["normalized"]
+            print(f"{statement['count']:>6} {before[key]:>9.2f} {after[key]:>9.2f}  {' '.join(statement['sql'].split())[:80]}")
+        print(f"\nWeighted workload time: {before_total:.1f} ms -> {after_total:.1f} ms")
+    finally:
+        conn.close()
+        if not args.apply:
+            shutil.rmtree(os.path.dirname(target), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
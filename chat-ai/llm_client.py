@@ -0,0 +1,209 @@
+"""
+Shared async client for the Azure OpenAI chat-completions and embeddings endpoints.
+
+Both `main.py` and `main_langraph.py` talk to the same deployment for the
+guardrail and query rephraser hops. A single pooled `httpx.AsyncClient` per
+process keeps those calls off the event loop and reuses keep-alive
+connections instead of paying a TLS handshake on every request.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+import httpx
+
+from tracing import tracer
+
+logger = logging.getLogger("uvicorn")
+
+# Same sampling parameters the blocking `requests` calls used.
+DEFAULT_CHAT_PARAMS = {
+    "temperature": 0.1,
+    "top_p": 1,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "max_tokens": 600,
+    "stop": None,
+}
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMClientError(Exception):
+    """Raised when an Azure OpenAI endpoint returns an unusable response."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class ChatResult:
+    content: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: float = 0.0
+    raw: dict = field(default_factory=dict, repr=False)
+
+
+class AzureChatClient:
+    """
+    Thin async wrapper around an Azure OpenAI REST deployment (chat-completions
+    via `chat`, embeddings via `embed`).
+
+    The underlying `httpx.AsyncClient` is created lazily so the object can be
+    built at import time and bound to the running uvicorn loop on first use.
+    """
+
+    def __init__(
+        self,
+        url,
+        api_key,
+        *,
+        max_connections=50,
+        max_keepalive_connections=20,
+        keepalive_expiry=30.0,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        retries=2,
+        backoff=0.5,
+        verify=True,
+    ):
+        self.url = url
+        self.api_key = api_key
+        self.retries = retries
+        self.backoff = backoff
+        self.verify = verify
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._client = None
+
+    @classmethod
+    def from_config(cls, section, url_key="azure_llm_gpt4_url", api_key_key="azure_api_key"):
+        """Build a client from the `[DEFAULT]` section of `config.ini`."""
+        return cls(
+            section[url_key],
+            section[api_key_key],
+            max_connections=section.getint("llm_max_connections", fallback=50),
+            max_keepalive_connections=section.getint("llm_max_keepalive_connections", fallback=20),
+            keepalive_expiry=section.getfloat("llm_keepalive_expiry", fallback=30.0),
+            connect_timeout=section.getfloat("llm_connect_timeout", fallback=5.0),
+            read_timeout=section.getfloat("llm_read_timeout", fallback=60.0),
+            retries=section.getint("llm_retries", fallback=2),
+            verify=section.getboolean("llm_ssl_verify", fallback=True),
+        )
+
+    @property
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=self.limits,
+                timeout=self.timeout,
+                verify=self.verify,
+                headers={"api-key": self.api_key, "Content-Type": "application/json"},
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    async def chat(self, messages, *, timeout=None, **params):
+        """POST `messages` to the chat-completions endpoint and return a `ChatResult`."""
+        payload = {**DEFAULT_CHAT_PARAMS, **params, "messages": messages}
+        with tracer.span("llm.chat", **{"llm.messages": len(messages)}) as span:
+            start_time = time.perf_counter()
+            response = await self._post(payload, timeout)
+            result = self._parse(response, time.perf_counter() - start_time)
+            span.set("llm.prompt_tokens", result.prompt_tokens)
+            span.set("llm.completion_tokens", result.completion_tokens)
+            return result
+
+    async def embed(self, texts, *, timeout=None):
+        """POST `texts` to an embeddings deployment and return one vector per text."""
+        with tracer.span("llm.embed", **{"llm.inputs": len(texts)}):
+            response = await self._post({"input": list(texts)}, timeout)
+            res = self._json(response)
+        try:
+            data = sorted(res["data"], key=lambda item: item.get("index", 0))
+            return [item["embedding"] for item in data]
+        except (KeyError, TypeError) as e:
+            raise LLMClientError(f"Unexpected Azure OpenAI embeddings response: {str(res)[:200]}") from e
+
+    async def _post(self, payload, timeout=None):
+        """
+        Transport errors and 408/429/5xx responses are retried with exponential
+        backoff (honouring `Retry-After`); the last response is returned as-is.
+        """
+        request_timeout = self.timeout if timeout is None else httpx.Timeout(timeout, connect=self.timeout.connect)
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * (2 ** attempt)
+            sent_ns = time.time_ns()
+            try:
+                response = await self.client.post(self.url, json=payload, timeout=request_timeout)
+            except httpx.TransportError as e:
+                tracer.record_span("llm.http", sent_ns, attempt=attempt + 1, error=str(e))
+                if attempt == self.retries:
+                    raise LLMClientError(f"Azure OpenAI request failed: {e}") from e
+                logger.warning(f"Azure OpenAI transport error (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(delay)
+                continue
+
+            tracer.record_span("llm.http", sent_ns, attempt=attempt + 1, **{"http.status_code": response.status_code})
+            if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.retries:
+                retry_after = response.headers.get("retry-after")
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                logger.warning(
+                    f"Azure OpenAI returned {response.status_code} (attempt {attempt + 1}), retrying in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            return response
+
+    @staticmethod
+    def _json(response):
+        try:
+            res = response.json()
+        except ValueError as e:
+            raise LLMClientError(
+                f"Azure OpenAI returned non-JSON response ({response.status_code}): {response.text[:200]}",
+                status_code=response.status_code,
+            ) from e
+
+        if response.status_code >= 400 or "error" in res:
+            error = res.get("error") or {}
+            message = error.get("message") if isinstance(error, dict) else str(error)
+            raise LLMClientError(
+                f"Azure OpenAI error ({response.status_code}): {message or response.text[:200]}",
+                status_code=response.status_code,
+            )
+        return res
+
+    @classmethod
+    def _parse(cls, response, latency):
+        res = cls._json(response)
+
+        try:
+            content = res["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError) as e:
+            raise LLMClientError(f"Unexpected Azure OpenAI response shape: {str(res)[:200]}") from e
+
+        usage = res.get("usage") or {}
+        return ChatResult(
+            content=content,
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+            latency=latency,
+            raw=res,
+        )
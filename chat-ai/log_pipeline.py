@@ -0,0 +1,184 @@
+"""
+Non-blocking structured logging for both services.
+
+`LogPipeline.start(logger, handler)` puts the blocking file handler behind a
+`QueueHandler`: request code only appends the record to an in-memory queue
+and a `QueueListener` thread formats it (one JSON object per line via
+python-json-logger) and writes / rotates the file. When the queue is full,
+records are dropped and counted rather than blocking the event loop.
+
+Large payloads (chat history, full request / response bodies) go through
+`LogPipeline.payload`, which logs them only for a `log_payload_sample_rate`
+share of requests. On the listener thread every string is cut to
+`log_payload_max_chars`, chat history is shaped by `log_history_mode`, and
+`log_redact_patterns` are masked before anything reaches the file.
+"""
+import contextvars
+import logging
+import queue
+import random
+import re
+from logging.handlers import QueueHandler, QueueListener
+
+from pythonjsonlogger.json import JsonFormatter
+
+JSON_FORMAT = "%(asctime)s %(levelname)s %(name)s %(process)d %(message)s"
+
+HISTORY_MODES = ("full", "truncate", "redact", "off")
+
+_request = contextvars.ContextVar("log_request", default=None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps records with the request bound in this context; runs on the emitting thread."""
+
+    def filter(self, record):
+        request = _request.get()
+        if request is not None:
+            record.request_id = request["request_id"]
+            record.user_id = request["user_id"]
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class PayloadFormatter(JsonFormatter):
+    """JSON formatter that truncates, shapes chat history and redacts before serialising."""
+
+    def __init__(self, *args, max_chars=2000, history_mode="truncate", history_max_turns=4, redact=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_chars = max_chars
+        self.history_mode = history_mode
+        self.history_max_turns = history_max_turns
+        self.redact = redact
+
+    def process_log_record(self, log_data):
+        payload = log_data.get("payload")
+        if isinstance(payload, dict) and "history" in payload:
+            history = self._history(payload["history"])
+            if history is None:
+                payload = {key: value for key, value in payload.items() if key != "history"}
+            else:
+                payload = {**payload, "history": history}
+            log_data["payload"] = payload
+        return {key: self._clean(value) for key, value in log_data.items()}
+
+    def _history(self, history):
+        if self.history_mode == "off":
+            return None
+        history = list(history or ())
+        if self.history_mode == "redact":
+            return [
+                {"role": message.get("role"), "chars": len(str(message.get("content", "")))}
+                if isinstance(message, dict) else {"chars": len(str(message))}
+                for message in history
+            ]
+        if self.history_mode == "truncate" and self.history_max_turns >= 0:
+            return history[len(history) - self.history_max_turns:] if len(history) > self.history_max_turns else history
+        return history
+
+    def _clean(self, value):
+        if isinstance(value, dict):
+            return {key: self._clean(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._clean(item) for item in value]
+        if isinstance(value, (bool, int, float)) or value is None:
+            return value
+        text = str(value)
+        for pattern in self.redact:
+            text = pattern.sub("[REDACTED]", text)
+        if self.max_chars and len(text) > self.max_chars:
+            text = f"{text[:self.max_chars]}... [{len(text) - self.max_chars} more chars]"
+        return text
+
+
+class LogPipeline:
+    def __init__(
+        self,
+        queue_size=10000,
+        payload_sample_rate=0.1,
+        payload_max_chars=2000,
+        history_mode="truncate",
+        history_max_turns=4,
+        redact_patterns=(),
+    ):
+        if history_mode not in HISTORY_MODES:
+            raise ValueError(f"log_history_mode must be one of {', '.join(HISTORY_MODES)}, got {history_mode!r}")
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.payload_sample_rate = payload_sample_rate
+        self.payload_max_chars = payload_max_chars
+        self.history_mode = history_mode
+        self.history_max_turns = history_max_turns
+        self.redact = [re.compile(pattern) for pattern in redact_patterns]
+        self.queue_handler = None
+        self.listener = None
+        self._rng = random.Random()
+
+    @classmethod
+    def from_config(cls, section):
+        patterns = section.get("log_redact_patterns", fallback="")
+        return cls(
+            queue_size=section.getint("log_queue_size", fallback=10000),
+            payload_sample_rate=section.getfloat("log_payload_sample_rate", fallback=0.1),
+            payload_max_chars=section.getint("log_payload_max_chars", fallback=2000),
+            history_mode=section.get("log_history_mode", fallback="truncate").strip().lower(),
+            history_max_turns=section.getint("log_history_max_turns", fallback=4),
+            redact_patterns=[line.strip() for line in patterns.splitlines() if line.strip()],
+        )
+
+    def formatter(self):
+        return PayloadFormatter(
+            JSON_FORMAT,
+            rename_fields={"asctime": "timestamp", "levelname": "level", "name": "logger", "process": "pid"},
+            json_default=str,
+            max_chars=self.payload_max_chars,
+            history_mode=self.history_mode,
+            history_max_turns=self.history_max_turns,
+            redact=self.redact,
+        )
+
+    def start(self, logger, handler):
+        """Route `logger` through the queue; `handler` now only runs on the listener thread."""
+        handler.setFormatter(self.formatter())
+        self.queue_handler = DroppingQueueHandler(self.queue)
+        self.queue_handler.addFilter(RequestContextFilter())
+        logger.addHandler(self.queue_handler)
+        self.listener = QueueListener(self.queue, handler, respect_handler_level=True)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """Flush queued records and stop the listener thread."""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def bind_request(self, request_id, user_id):
+        """Tag this request's records and decide once whether its payloads are logged."""
+        sampled = self.payload_sample_rate >= 1 or self._rng.random() < self.payload_sample_rate
+        _request.set({"request_id": request_id, "user_id": user_id, "sampled": sampled})
+
+    def payload(self, logger, message, **payload):
+        """Log a large payload (e.g. `history=`, `response=`) only if this request was sampled."""
+        request = _request.get()
+        if request is None or not request["sampled"] or not logger.isEnabledFor(logging.INFO):
+            return
+        # Lists are copied because the record is serialised later, on the listener thread.
+        payload = {key: list(value) if isinstance(value, list) else value for key, value in payload.items()}
+        logger.info(message, extra={"payload": payload})
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.queue_handler.dropped if self.queue_handler is not None else 0,
+        }
@@ -0,0 +1,97 @@
+"""
+Prometheus metrics for both services, served on `/metrics`.
+
+  chat_stage_duration_seconds{stage}        guardrail, rephraser, answer_cache, sql_template,
+                                            sql_agent and the whole request
+  chat_agent_iterations                     model turns per SQL agent run
+  chat_tool_duration_seconds{tool,status}   each SQL agent tool call
+  chat_sql_duration_seconds{status}         each statement run by the QueryGovernor
+  chat_llm_call_duration_seconds{stage}     each LLM call
+  chat_llm_calls_total{stage}
+  chat_llm_tokens_total{stage,kind}         prompt / completion tokens (from prompt_registry)
+  chat_cache_requests_total{cache,result}   answer, guardrail, sql_result and sql_template lookups
+  chat_guardrail_verdicts_total{source,verdict}
+  chat_errors_total{code}                   the 10xx codes logged by the services
+
+Under several uvicorn workers set `PROMETHEUS_MULTIPROC_DIR` so the endpoint
+aggregates every worker's samples.
+"""
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, make_asgi_app, multiprocess
+
+# Seconds; LLM hops and agent runs sit in the upper half, cache lookups and SQL in the lower.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "chat_stage_duration_seconds", "Wall-clock time per pipeline stage.", ["stage"], buckets=LATENCY_BUCKETS
+)
+AGENT_ITERATIONS = Histogram(
+    "chat_agent_iterations", "Model turns per SQL agent run.", buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30)
+)
+TOOL_SECONDS = Histogram(
+    "chat_tool_duration_seconds", "SQL agent tool call time.", ["tool", "status"], buckets=LATENCY_BUCKETS
+)
+SQL_SECONDS = Histogram(
+    "chat_sql_duration_seconds", "Governed SQL statement time, including the plan check.", ["status"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_SECONDS = Histogram(
+    "chat_llm_call_duration_seconds", "Latency of one LLM call.", ["stage"], buckets=LATENCY_BUCKETS
+)
+LLM_CALLS = Counter("chat_llm_calls_total", "LLM calls.", ["stage"])
+LLM_TOKENS = Counter("chat_llm_tokens_total", "LLM tokens.", ["stage", "kind"])
+CACHE_REQUESTS = Counter("chat_cache_requests_total", "Cache lookups by outcome.", ["cache", "result"])
+GUARDRAIL_VERDICTS = Counter(
+    "chat_guardrail_verdicts_total", "Guardrail verdicts by where they were decided.", ["source", "verdict"]
+)
+ERRORS = Counter("chat_errors_total", "Errors by the service's error code.", ["code"])
+
+_ERROR_CODE = re.compile(r"^\s*(\d{4})\b")
+
+
+@contextmanager
+def time_stage(stage):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start_time)
+
+
+def record_llm(stage, prompt_tokens=0, completion_tokens=0, latency=0.0):
+    LLM_CALLS.labels(stage).inc()
+    LLM_TOKENS.labels(stage, "prompt").inc(prompt_tokens or 0)
+    LLM_TOKENS.labels(stage, "completion").inc(completion_tokens or 0)
+    if latency:
+        LLM_SECONDS.labels(stage).observe(latency)
+
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_guardrail(source, unsafe):
+    GUARDRAIL_VERDICTS.labels(source, "unsafe" if unsafe else "safe").inc()
+
+
+def error_code(error, default):
+    """The leading 10xx code of an error message (e.g. "1003 - Error in ..."), else `default`."""
+    match = _ERROR_CODE.match(str(error))
+    return match.group(1) if match else default
+
+
+def record_error(error, default):
+    ERRORS.labels(error_code(error, default)).inc()
+
+
+def metrics_app():
+    """ASGI app for `/metrics`, aggregating all workers when `PROMETHEUS_MULTIPROC_DIR` is set."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return make_asgi_app(registry=registry)
+    return make_asgi_app()
@@ -0,0 +1,224 @@
+"""
+Local, CPU-only first stage in front of the LLM guardrail.
+
+Two layers, both compiled once at import:
+  1. Lexicon rules - profanity and prompt-injection patterns. A hit is a
+     confident Unsafe verdict.
+  2. Scoring model - a small linear model over regex-derived features
+     (greeting-only input, HR/LATAM domain vocabulary, insults, markup,
+     instruction verbs, demographic and judgement terms, length, non-ASCII
+     share). The logit is computed
+     with numpy so whole batches can be scored at once.
+
+Inputs the model is confident about get an Unsafe verdict directly. A local
+Safe is only given to greeting-only input and to input whose every word is in
+the closed domain vocabulary (`SAFE_VOCABULARY`): padding a request with
+domain terms cannot carry arbitrary text past the LLM guardrail. Everything
+else returns `None` and goes to the Azure guardrail as before.
+"""
+import re
+from dataclasses import dataclass
+
+import numpy as np
+
+LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s", "!": "i"})
+
+PROFANITY = [
+    "fuck", "fucking", "fucker", "motherfucker", "shit", "shitty", "bullshit", "bitch", "bastard",
+    "asshole", "dick", "dickhead", "cunt", "prick", "twat", "wanker", "bollocks", "slut", "whore",
+    "retard", "retarded",
+    # Spanish / Portuguese, common with LATAM users
+    "mierda", "puta", "puto", "pendejo", "cabron", "cabrón", "chingada", "verga", "culero",
+    "caralho", "porra", "merda", "buceta", "filho da puta", "hijo de puta",
+]
+
+INJECTION_PATTERNS = [
+    r"\bignore (all |any |the )?(previous|prior|above|earlier|system)\b.{0,20}\b(instructions?|rules|prompts?)\b",
+    r"\b(ignore|forget|bypass|skip) (all |any |the |your |these |those |my )?(rules|instructions?|guardrails?|guidelines|policy|filters?)\b",
+    r"\b(just |only |always )?(respond|reply|answer|say|output|return|classify (it|this) as)( with)? [\"']?(safe|0)[\"']?\s*[.!]?\s*$",
+    r"\bdisregard (all |any |the )?(previous|prior|above|system)\b",
+    r"\b(reveal|show|print|repeat|display|leak)\b.{0,30}\b(system prompt|instructions|initial prompt|hidden prompt)\b",
+    r"\bwhat (is|are) your (system )?(prompt|instructions|rules)\b",
+    r"\byou are now\b",
+    r"\b(developer|god|dan|jailbreak) mode\b",
+    r"\bjailbreak\b",
+    r"\bpretend (you are|to be) (an? )?(unrestricted|unfiltered|evil)\b",
+    r"\boverride (your|the) (rules|instructions|guardrails?)\b",
+    r"\bi am (the |your )?(developer|admin|administrator)\b.{0,40}\b(ignore|bypass|disable)\b",
+    r"<\s*script\b",
+    r"\bjavascript:",
+]
+
+GREETINGS = [
+    "hi", "hello", "hey", "hola", "ola", "olá", "good morning", "good afternoon", "good evening",
+    "thanks", "thank you", "thank you so much", "gracias", "obrigado", "obrigada", "ok", "okay",
+    "bye", "goodbye", "yes", "no", "great", "cool", "how are you",
+]
+
+DOMAIN_TERMS = [
+    "policy", "policies", "leave", "leaves", "maternity", "paternity", "parental", "pension", "retirement",
+    "benefit", "benefits", "bonus", "salary", "salaries", "compensation", "employee", "employees", "headcount",
+    "holiday", "holidays", "vacation", "sick", "remote", "hybrid", "training", "program", "programs", "insurance",
+    "allowance", "payroll", "hr", "country", "countries", "region", "latam", "brazil", "mexico", "argentina",
+    "colombia", "chile", "peru", "ecuador", "uruguay", "paraguay", "venezuela", "bolivia", "panama", "costa rica",
+    "guatemala", "puerto rico", "dominican republic", "sfdc", "summit", "askgs", "jaida", "bwi", "iris", "concur",
+    "emarketplace", "how many", "list", "top", "average", "total", "count",
+]
+
+INSULTS = ["idiot", "stupid", "dumb", "moron", "useless", "loser", "ugly", "shut up", "hate you", "pathetic", "trash"]
+
+# Demographic groups and value judgements: never confidently Safe, leave to the LLM (bias rule).
+SENSITIVE_TERMS = [
+    "women", "woman", "men", "man", "female", "male", "gender", "gay", "lesbian", "trans", "transgender",
+    "black", "white", "asian", "latino", "latina", "indian", "race", "racial", "religion", "religious",
+    "muslim", "muslims", "jew", "jews", "jewish", "christian", "christians", "catholic", "catholics", "hindu",
+    "hindus", "gays", "lesbians", "blacks", "whites", "asians", "latinos", "indians", "women's", "men's", "old", "older", "elderly", "young", "younger", "disabled", "pregnant",
+    "foreigners", "immigrants", "nationality",
+]
+
+JUDGEMENT_TERMS = [
+    "lazy", "lazier", "laziest", "worse", "worst", "better than", "smarter", "dumber", "inferior", "superior",
+    "rumor", "rumour", "gossip", "fake news", "should not get", "shouldn't get", "don't deserve", "do not deserve",
+    "hate", "incompetent", "cheaper to fire", "fire all",
+]
+
+INSTRUCTION_VERBS = [
+    "write", "compose", "draft", "create a post", "social media", "tweet", "email", "pretend", "roleplay",
+    "role play", "act as", "summarize this", "translate this", "joke",
+]
+
+# Words that carry no request of their own. With DOMAIN_TERMS and plain numbers this is the whole
+# vocabulary a locally-Safe question may use; any other word sends the input to the LLM guardrail.
+FUNCTION_WORDS = [
+    "what", "which", "how", "many", "much", "who", "when", "where", "is", "are", "was", "were", "do", "does",
+    "did", "can", "the", "a", "an", "of", "in", "for", "per", "by", "to", "on", "at", "and", "or", "with",
+    "from", "between", "our", "we", "there", "have", "has", "me", "my", "show", "give", "get", "please",
+    "each", "all", "number", "days", "weeks", "months", "year", "years", "current", "details", "about",
+    "available", "eligible", "eligibility", "rules", "type", "types", "enrolled", "enrollment", "work",
+    "offer", "offers", "cover", "covers", "compare", "across", "expenses", "this", "you", "i",
+]
+
+MARKUP_RE = re.compile(r"<[^>]{1,40}>|\{\{.*?\}\}|\$\{.*?\}|```")
+QUESTION_RE = re.compile(r"\?\s*$|^(what|which|how|who|when|where|why|is|are|does|do|can|list|show|tell|give)\b")
+
+
+def _phrase_regex(phrases):
+    alternatives = sorted((re.escape(p) for p in phrases), key=len, reverse=True)
+    return re.compile(r"(?<![a-z])(" + "|".join(alternatives) + r")(?![a-z])")
+
+
+PROFANITY_RE = _phrase_regex(PROFANITY)
+INJECTION_RE = re.compile("|".join(f"(?:{p})" for p in INJECTION_PATTERNS))
+GREETING_ONLY_RE = re.compile(r"^(" + "|".join(re.escape(g) for g in GREETINGS) + r")([\s,!.?]+(" + "|".join(re.escape(g) for g in GREETINGS) + r"))*[\s!.?]*$")
+DOMAIN_RE = _phrase_regex(DOMAIN_TERMS)
+INSULT_RE = _phrase_regex(INSULTS)
+INSTRUCTION_RE = _phrase_regex(INSTRUCTION_VERBS)
+SENSITIVE_RE = _phrase_regex(SENSITIVE_TERMS)
+JUDGEMENT_RE = _phrase_regex(JUDGEMENT_TERMS)
+WORD_RE = re.compile(r"[^\W_]+(?:'[^\W_]+)?")
+# Only single-word sensitive/judgement terms are removed; SENSITIVE_RE and
+# JUDGEMENT_RE catch the phrases, so "do", "get" or "all" stay usable.
+SAFE_VOCABULARY = frozenset(
+    word for phrase in DOMAIN_TERMS + FUNCTION_WORDS for word in phrase.split()
+) - frozenset(term for term in SENSITIVE_TERMS + JUDGEMENT_TERMS if " " not in term)
+
+FEATURES = (
+    "greeting_only",
+    "domain_hits",
+    "question_form",
+    "insult_hits",
+    "markup_hits",
+    "instruction_hits",
+    "sensitive_hits",
+    "judgement_hits",
+    "long_input",
+    "non_ascii_ratio",
+)
+
+# Fitted on benchmarks/data/guardrail_corpus.jsonl; positive pushes towards Unsafe. The thresholds are
+# checked against the held-out benchmarks/data/guardrail_holdout.jsonl (bench_pre_guardrail.py).
+WEIGHTS = np.array([-8.0, -1.6, -0.8, 4.5, 3.0, 2.5, 2.5, 4.0, 2.0, 4.0])
+BIAS = 0.0
+SAFE_LOGIT = -3.5    # P(unsafe) <= ~0.03
+UNSAFE_LOGIT = 3.5   # P(unsafe) >= ~0.97
+
+
+@dataclass
+class PreGuardrailResult:
+    verdict: object  # "Safe", "Unsafe" or None when the LLM guardrail must decide
+    score: float
+    reason: str
+
+
+def normalize(text):
+    text = " ".join(text.lower().split())
+    return text, text.translate(LEET)
+
+
+def features(text):
+    plain, deleeted = normalize(text)
+    words = plain.split()
+    non_ascii = sum(1 for ch in plain if ord(ch) > 127 and ch.isalpha())
+    letters = sum(1 for ch in plain if ch.isalpha()) or 1
+    return [
+        1.0 if GREETING_ONLY_RE.match(plain) else 0.0,
+        float(min(len(DOMAIN_RE.findall(plain)), 3)),
+        1.0 if QUESTION_RE.search(plain) else 0.0,
+        float(min(len(INSULT_RE.findall(deleeted)), 2)),
+        float(min(len(MARKUP_RE.findall(plain)), 2)),
+        float(min(len(INSTRUCTION_RE.findall(plain)), 2)),
+        float(min(len(SENSITIVE_RE.findall(plain)), 2)),
+        float(min(len(JUDGEMENT_RE.findall(plain)), 2)),
+        1.0 if len(words) > 60 else 0.0,
+        non_ascii / letters,
+    ]
+
+
+def lexicon_reason(text):
+    plain, deleeted = normalize(text)
+    if PROFANITY_RE.search(plain) or PROFANITY_RE.search(deleeted):
+        return "profanity"
+    if INJECTION_RE.search(plain):
+        return "prompt_injection"
+    return None
+
+
+def in_safe_vocabulary(text):
+    """True when every word is a domain term, a function word or a number."""
+    words = WORD_RE.findall(normalize(text)[0])
+    return bool(words) and all(word.isdigit() or word in SAFE_VOCABULARY for word in words)
+
+
+def _verdict(logit, text):
+    if logit >= UNSAFE_LOGIT:
+        return "Unsafe"
+    if logit <= SAFE_LOGIT and (GREETING_ONLY_RE.match(normalize(text)[0]) or in_safe_vocabulary(text)):
+        return "Safe"
+    return None
+
+
+def classify(text):
+    """Classify one input; `verdict` is None when the input is ambiguous."""
+    reason = lexicon_reason(text)
+    if reason:
+        return PreGuardrailResult("Unsafe", float("inf"), reason)
+    if not text.strip():
+        return PreGuardrailResult(None, 0.0, "empty")
+    logit = float(np.dot(WEIGHTS, features(text)) + BIAS)
+    verdict = _verdict(logit, text)
+    return PreGuardrailResult(verdict, logit, "model" if verdict else "ambiguous")
+
+
+def classify_batch(texts):
+    """Vectorized variant of `classify` for benchmarks and offline labelling."""
+    matrix = np.array([features(text) for text in texts], dtype=float).reshape(len(texts), len(FEATURES))
+    logits = matrix @ WEIGHTS + BIAS
+    results = []
+    for text, logit in zip(texts, logits):
+        reason = lexicon_reason(text)
+        if reason:
+            results.append(PreGuardrailResult("Unsafe", float("inf"), reason))
+        else:
+            verdict = _verdict(float(logit), text)
+            results.append(PreGuardrailResult(verdict, float(logit), "model" if verdict else "ambiguous"))
+    return results
@@ -0,0 +1,146 @@
+"""
+Result cache for the agent's `sql_db_query` tool calls.
+
+The ReAct agent re-issues the same statements (the "top 5 by country"
+aggregates) across users and across retries within one run. Results are kept
+in an LRU keyed on the normalized SQL text, bounded by the total size of the
+cached result strings rather than by entry count, so a few wide results
+cannot pin an unbounded amount of memory.
+
+Every entry is dropped when `cs_latam.db` changes: the file fingerprint
+(mtime/size of the db and its WAL) catches replaced files, and `PRAGMA
+data_version` on a dedicated read-only connection catches commits from other
+connections that land within the mtime granularity.
+"""
+import logging
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import metrics
+from db_pool import readonly_uri
+from schema_catalog import db_fingerprint
+
+logger = logging.getLogger("uvicorn")
+
+# Single-quoted literals and double-quoted identifiers keep their case and spacing.
+_SQL_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|(--[^\n]*|/\*.*?\*/)|(\s+)|([^'"\s/-]+|.)""", re.S)
+
+
+def normalize_sql(sql):
+    """Case/space-fold `sql` outside quoted literals and drop comments and trailing semicolons."""
+    parts = []
+    for quoted, comment, space, other in _SQL_TOKENS.findall(sql or ""):
+        if quoted:
+            parts.append(quoted)
+        elif comment or space:
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(other.lower())
+    return "".join(parts).rstrip("; ")
+
+
+def is_cacheable_result(result):
+    """`SQLDatabase.run_no_throw` reports failures as an "Error: ..." string; those are retried, not cached."""
+    return isinstance(result, str) and not result.startswith("Error:")
+
+
+class QueryResultCache:
+    def __init__(self, db_path, max_bytes=32 * 1024 * 1024, max_entry_bytes=1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._conn = None
+
+    @classmethod
+    def from_config(cls, section, db_path):
+        """Build the cache from `config.ini`; returns `None` when `sql_cache_enabled` is false."""
+        if not section.getboolean("sql_cache_enabled", fallback=True):
+            return None
+        return cls(
+            db_path,
+            max_bytes=section.getint("sql_cache_max_bytes", fallback=32 * 1024 * 1024),
+            max_entry_bytes=section.getint("sql_cache_max_entry_bytes", fallback=1024 * 1024),
+        )
+
+    def _data_version(self):
+        try:
+            if self._conn is None:
+                self._conn = sqlite3.connect(readonly_uri(self.db_path), uri=True, check_same_thread=False)
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def _sync(self):
+        """Drop every entry if the database changed since the last lookup. Caller holds the lock."""
+        version = (db_fingerprint(self.db_path), self._data_version())
+        if version != self._version:
+            if self._version is not None and self._entries:
+                self.invalidations += 1
+                logger.info(f"{self.db_path} changed, dropping {len(self._entries)} cached SQL results")
+            self._entries.clear()
+            self.bytes = 0
+            self._version = version
+
+    def get(self, sql):
+        key = normalize_sql(sql)
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, sql, result):
+        if not is_cacheable_result(result):
+            return
+        size = len(result.encode("utf-8"))
+        if size > self.max_entry_bytes:
+            return
+        key = normalize_sql(sql)
+        with self._lock:
+            self._sync()
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def get_or_run(self, sql, run):
+        """Cached result of `sql`, or `run()`'s result (stored if cacheable)."""
+        result = self.get(sql)
+        metrics.record_cache("sql_result", result is not None)
+        if result is None:
+            result = run()
+            self.set(sql, result)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
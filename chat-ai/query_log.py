@@ -0,0 +1,98 @@
+"""
+Log of the SQL the agent runs against `cs_latam.db`.
+
+`QueryGovernor` records every statement it executes (or rejects) with its
+wall-clock time, row count, outcome and `EXPLAIN QUERY PLAN` output in a
+small SQLite file (WAL mode, so several uvicorn workers can share it). The
+log is the input of the offline index advisor (`index_advisor.py`); the
+newest `max_rows` entries are kept.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from query_cache import normalize_sql
+
+logger = logging.getLogger("uvicorn")
+
+TRIM_EVERY = 1000
+
+
+class QueryLog:
+    def __init__(self, path, max_rows=100_000):
+        self.path = path
+        self.max_rows = max_rows
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sql_queries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, sql TEXT NOT NULL, "
+            "normalized TEXT NOT NULL, duration_ms REAL NOT NULL, rows INTEGER, status TEXT NOT NULL, "
+            "plan TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sql_queries_normalized ON sql_queries(normalized)")
+        self._conn.commit()
+
+    @classmethod
+    def from_config(cls, section):
+        """Open the log from `config.ini`; returns `None` when `sql_query_log_path` is empty."""
+        path = section.get("sql_query_log_path", fallback="")
+        if not path:
+            return None
+        return cls(path, max_rows=section.getint("sql_query_log_max_rows", fallback=100_000))
+
+    def record(self, sql, duration_ms, rows, status, plan):
+        """Append one execution; `status` is "ok" or a `GovernorError` code. Never raises."""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO sql_queries(created_at, sql, normalized, duration_ms, rows, status, plan) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), sql, normalize_sql(sql), duration_ms, rows, status, json.dumps(plan or [])),
+                )
+                self.recorded += 1
+                if self.recorded % TRIM_EVERY == 0:
+                    self._conn.execute(
+                        "DELETE FROM sql_queries WHERE id <= (SELECT MAX(id) FROM sql_queries) - ?",
+                        (self.max_rows,),
+                    )
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record SQL query in {self.path}: {e}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        return {"recorded": self.recorded, "path": self.path}
+
+
+def load_workload(path, status="ok"):
+    """Logged statements grouped by normalized SQL: one dict per statement with its count, timings and plan."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT normalized, MIN(sql), COUNT(*), AVG(duration_ms), MAX(duration_ms), "
+            "(SELECT plan FROM sql_queries p WHERE p.normalized = q.normalized ORDER BY id DESC LIMIT 1) "
+            "FROM sql_queries q WHERE status = ? GROUP BY normalized ORDER BY COUNT(*) * AVG(duration_ms) DESC",
+            (status,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [
+        {
+            "normalized": normalized,
+            "sql": sql,
+            "count": count,
+            "avg_ms": avg_ms,
+            "max_ms": max_ms,
+            "plan": [tuple(step) for step in json.loads(plan)],
+        }
+        for normalized, sql, count, avg_ms, max_ms, plan in rows
+    ]
@@ -0,0 +1,153 @@
+"""
+Rule engine in front of the query rephraser LLM call.
+
+The rephraser prompt already spells out the cases where the input must come
+back unchanged: an empty `old_chat`, meaningless single keywords such as
+"yes"/"no", and profanity (answered with a fixed message). Those are decided
+here without a round-trip. Acronym typos from the prompt's fixed list are
+corrected locally with an edit-distance match.
+
+Anything that needs the model - a non-English input to translate, an explicit
+summarize/enhance task, or a follow-up that has history to rephrase against -
+returns `None` and goes to the LLM as before.
+"""
+import re
+from dataclasses import dataclass
+
+import pre_guardrail
+
+PROFANE_RESPONSE = "DO NOT USE PROFANE LANGUAGE"
+
+# Canonical spellings from the rephraser prompt.
+ACRONYMS = ["SFDC", "SUMMIT", "ASKGS", "JAIDA", "BWI", "JNJ", "IRIS", "Concur", "emarketplace"]
+
+# Real words within edit distance of an acronym that must not be "corrected". Plurals of the
+# terms themselves ("summits") are recognised by `_stems` and need no entry here.
+NOT_ACRONYMS = {"submit", "irs", "irish", "bmi", "bwa", "concurs", "asks", "aids", "jaid", "iris's"}
+
+PASS_THROUGH_KEYWORDS = {
+    "yes", "no", "ok", "okay", "sure", "come", "process", "tell", "continue", "proceed", "go", "done",
+    "hi", "hello", "hey", "thanks", "thank you", "thank you so much", "bye", "goodbye", "great", "cool",
+}
+
+TASK_WORDS = [
+    "summarize", "summarise", "summary", "shorten", "enhance", "improve", "rewrite", "rephrase",
+    "paraphrase", "translate", "expand", "elaborate",
+]
+
+# Spanish/Portuguese function words: the prompt asks the model to translate these inputs first.
+FOREIGN_WORDS = [
+    "que", "cual", "cuales", "cuantos", "cuantas", "los", "las", "para", "como", "donde", "del", "una", "hay",
+    "politica", "politicas", "empleados", "licencia", "qual", "quais", "quantos", "quantas", "sobre",
+    "funcionarios", "licenca", "pais", "paises",
+]
+
+WORD_RE = re.compile(r"[A-Za-z]+")
+TASK_RE = re.compile(r"(?<![a-z])(" + "|".join(TASK_WORDS) + r")(?![a-z])")
+FOREIGN_RE = re.compile(r"(?<![a-z])(" + "|".join(FOREIGN_WORDS) + r")(?![a-z])")
+
+
+@dataclass
+class RephraseRuleResult:
+    text: str
+    rule: str
+
+
+def edit_distance(a, b, limit=2):
+    """Optimal string alignment distance (Levenshtein plus adjacent transpositions), capped at `limit + 1`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _max_distance(acronym):
+    return 2 if len(acronym) > 6 else 1
+
+
+def _match_case(word, acronym):
+    if word.islower():
+        return acronym.lower()
+    if word.isupper():
+        return acronym.upper()
+    return acronym
+
+
+def _stems(word):
+    """`word` and its forms without a plural suffix ("summits" -> "summit", "irises" -> "iris")."""
+    stems = {word}
+    if len(word) > 3 and word.endswith("s"):
+        stems.add(word[:-1])
+    if len(word) > 4 and word.endswith("es"):
+        stems.add(word[:-2])
+    return stems
+
+
+def correct_word(word):
+    lowered = word.lower()
+    if len(lowered) < 3 or lowered in NOT_ACRONYMS:
+        return word
+    stems = _stems(lowered)
+    best, best_distance = None, None
+    for acronym in ACRONYMS:
+        target = acronym.lower()
+        # The term itself or an inflected form of it ("summits") is what the user meant.
+        if target in stems:
+            return word
+        if lowered[0] != target[0]:
+            continue
+        limit = _max_distance(target)
+        # Three-letter acronyms only tolerate a substitution/transposition.
+        if len(target) <= 3 and len(lowered) != len(target):
+            continue
+        distance = edit_distance(lowered, target, limit)
+        if distance <= limit and (best_distance is None or distance < best_distance):
+            best, best_distance = acronym, distance
+    return _match_case(word, best) if best else word
+
+
+def correct_acronyms(text):
+    """Replace near-miss spellings of the known acronyms, e.g. 'aukgs' -> 'askgs'."""
+    return WORD_RE.sub(lambda m: correct_word(m.group(0)), text)
+
+
+def has_user_history(msg_history):
+    return any(msg.get("role") == "user" for msg in msg_history or [])
+
+
+def needs_llm(text):
+    """True when the prompt asks the model to translate or perform a task on the text."""
+    plain = " ".join(text.lower().split())
+    if any(ord(ch) > 127 and ch.isalpha() for ch in plain):
+        return True
+    return bool(TASK_RE.search(plain) or FOREIGN_RE.search(plain))
+
+
+def is_pass_through_keyword(text):
+    return " ".join(WORD_RE.findall(text.lower())) in PASS_THROUGH_KEYWORDS
+
+
+def apply(query, msg_history):
+    """Rephrase `query` locally, or return `None` when the LLM rephraser is needed."""
+    if not query or not query.strip():
+        return None
+    if pre_guardrail.lexicon_reason(query) == "profanity":
+        return RephraseRuleResult(PROFANE_RESPONSE, "profanity")
+    if needs_llm(query):
+        return None
+    if not has_user_history(msg_history):
+        return RephraseRuleResult(correct_acronyms(query), "empty_history")
+    if is_pass_through_keyword(query):
+        return RephraseRuleResult(query, "keyword")
+    return None
@@ -0,0 +1,226 @@
+"""
+Precomputed schema catalog for the SQL agent.
+
+Introspects the SQLite database once (tables, columns, types, foreign keys,
+sample rows and the values of low-cardinality text columns) and renders the
+slice relevant to a question straight into the agent prompt, so the agent no
+longer spends LLM turns on `sql_db_list_tables` / `sql_db_schema`. The
+catalog is rebuilt whenever the database file changes on disk.
+"""
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger("uvicorn")
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+MAX_VALUE_CHARS = 100
+
+
+def db_fingerprint(db_path):
+    """Cheap change detector for a SQLite file: (mtime_ns, size) of the db and its WAL."""
+    try:
+        stat = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    fingerprint = (stat.st_mtime_ns, stat.st_size)
+    try:
+        wal = os.stat(db_path + "-wal")
+        fingerprint += (wal.st_mtime_ns, wal.st_size)
+    except FileNotFoundError:
+        pass
+    return fingerprint
+
+
+def _words(text):
+    words = set()
+    for word in WORD_RE.findall(str(text).lower()):
+        words.add(word)
+        if len(word) > 4 and word.endswith("ies"):
+            words.add(word[:-3] + "y")
+        elif len(word) > 3 and word.endswith("s"):
+            words.add(word[:-1])
+    return words
+
+
+def _cell(value):
+    text = str(value)
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS] + "..."
+
+
+class SchemaCatalog:
+    def __init__(self, db_path, sample_rows=3, max_tables=5, max_distinct_values=50):
+        self.db_path = db_path
+        self.sample_rows = sample_rows
+        self.max_tables = max_tables
+        self.max_distinct_values = max_distinct_values
+        self.tables = {}
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._value_re = None
+        self._value_re_fingerprint = None
+
+    @property
+    def version(self):
+        """Identifies the schema snapshot the catalog was built from."""
+        return "-".join(str(part) for part in self.fingerprint) if self.fingerprint else "empty"
+
+    @property
+    def schema_version(self):
+        """Hash of the table and view DDL; unlike `version`, unchanged by data-only writes."""
+        self.refresh_if_changed()
+        if not self.tables:
+            return "empty"
+        ddl = "\n".join(table["ddl"] for _, table in sorted(self.tables.items()))
+        return hashlib.sha1(ddl.encode("utf-8")).hexdigest()[:16]
+
+    def refresh_if_changed(self):
+        fingerprint = db_fingerprint(self.db_path)
+        if fingerprint is None:
+            if self.tables:
+                logger.warning(f"Schema catalog: {self.db_path} not found, clearing catalog")
+                self.tables = {}
+                self.fingerprint = None
+            return False
+        if fingerprint == self.fingerprint:
+            return False
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.tables = self._build()
+                self.fingerprint = fingerprint
+                logger.info(f"Schema catalog built for {len(self.tables)} tables from {self.db_path}")
+                return True
+        return False
+
+    def _build(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            tables = {}
+            rows = conn.execute(
+                "SELECT name, type, sql FROM sqlite_master "
+                "WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()
+            for name, kind, ddl in rows:
+                quoted = '"' + name.replace('"', '""') + '"'
+                columns = [
+                    {"name": col[1], "type": col[2] or "", "notnull": bool(col[3]), "pk": bool(col[5])}
+                    for col in conn.execute(f"PRAGMA table_info({quoted})")
+                ]
+                foreign_keys = [
+                    {"column": fk[3], "ref_table": fk[2], "ref_column": fk[4]}
+                    for fk in conn.execute(f"PRAGMA foreign_key_list({quoted})")
+                ]
+                samples = conn.execute(f"SELECT * FROM {quoted} LIMIT {int(self.sample_rows)}").fetchall()
+
+                values = {}
+                for column in columns:
+                    if "CHAR" not in column["type"].upper() and "TEXT" not in column["type"].upper():
+                        continue
+                    col = '"' + column["name"].replace('"', '""') + '"'
+                    distinct = conn.execute(
+                        f"SELECT DISTINCT {col} FROM {quoted} WHERE {col} IS NOT NULL LIMIT {self.max_distinct_values + 1}"
+                    ).fetchall()
+                    if len(distinct) <= self.max_distinct_values:
+                        values[column["name"]] = [row[0] for row in distinct]
+
+                words = _words(name)
+                value_words = set()
+                for column in columns:
+                    words |= _words(column["name"].replace("_", " "))
+                for column_values in values.values():
+                    for value in column_values:
+                        value_words |= _words(value)
+
+                tables[name] = {
+                    "kind": kind,
+                    "ddl": ddl or "",
+                    "columns": columns,
+                    "foreign_keys": foreign_keys,
+                    "samples": samples,
+                    "values": values,
+                    "name_words": _words(name.replace("_", " ")),
+                    "column_words": words,
+                    "value_words": value_words,
+                }
+            return tables
+        finally:
+            conn.close()
+
+    def table_names(self):
+        self.refresh_if_changed()
+        return list(self.tables)
+
+    def relevant_tables(self, question, limit=None):
+        """Tables ranked by overlap between the question and table names, columns and values."""
+        self.refresh_if_changed()
+        limit = limit or self.max_tables
+        tables = self.tables
+        if len(tables) <= limit:
+            return list(tables)
+
+        question_words = _words(question)
+        scored = []
+        for name, table in tables.items():
+            score = (
+                3 * len(question_words & table["name_words"])
+                + 2 * len(question_words & table["column_words"])
+                + len(question_words & table["value_words"])
+            )
+            if score:
+                scored.append((score, name))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        selected = [name for _, name in scored[:limit]]
+
+        # Pull in tables referenced by foreign keys so joins can be written.
+        for name in list(selected):
+            for fk in tables[name]["foreign_keys"]:
+                if fk["ref_table"] in tables and fk["ref_table"] not in selected and len(selected) < limit:
+                    selected.append(fk["ref_table"])
+        return selected
+
+    def value_mentions(self, text):
+        """Low-cardinality column values (countries, policy types, ...) named in `text`, lower-cased."""
+        self.refresh_if_changed()
+        if self._value_re_fingerprint != self.fingerprint:
+            values = set()
+            for table in self.tables.values():
+                for column_values in table["values"].values():
+                    for value in column_values:
+                        value = " ".join(WORD_RE.findall(str(value).lower()))
+                        if len(value) > 1 and not value.isdigit():
+                            values.add(value)
+            alternatives = sorted((re.escape(value) for value in values), key=len, reverse=True)
+            self._value_re = re.compile(r"\b(" + "|".join(alternatives) + r")\b") if alternatives else None
+            self._value_re_fingerprint = self.fingerprint
+        if self._value_re is None:
+            return frozenset()
+        return frozenset(self._value_re.findall(" ".join(WORD_RE.findall(str(text).lower()))))
+
+    def render(self, table_names):
+        parts = []
+        for name in table_names:
+            table = self.tables[name]
+            ddl = table["ddl"].strip() or f"CREATE TABLE {name} (...)"
+            parts.append(ddl)
+            if table["samples"]:
+                header = "\t".join(column["name"] for column in table["columns"])
+                rows = "\n".join("\t".join(_cell(value) for value in row) for row in table["samples"])
+                parts.append(f"/*\n{len(table['samples'])} rows from {name} table:\n{header}\n{rows}\n*/")
+        return "\n\n".join(parts)
+
+    def context_for(self, question):
+        """Prompt-ready schema slice for `question`; empty if the catalog is unavailable."""
+        try:
+            selected = self.relevant_tables(question)
+        except sqlite3.Error as e:
+            logger.error(f"Schema catalog error: {e}")
+            return ""
+        if not self.tables:
+            return ""
+        header = "Tables in the database: " + ", ".join(self.tables)
+        if not selected:
+            return header
+        return header + "\n\n" + self.render(selected)
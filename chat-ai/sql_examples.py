@@ -0,0 +1,206 @@
+"""
+Few-shot store of verified question -> SQL pairs for the SQL agent.
+
+When a SQL agent run ends with a usable answer, its rephrased question and
+the last `sql_db_query` statement that ran without error are stored
+together with the schema version they were written against. Before the
+next run, the closest stored questions (Azure embeddings + a `sqlite-vec`
+index) are rendered into the agent prompt as worked examples. A recurring
+question shape then starts from a known-good query instead of rediscovering
+tables and columns over several ReAct turns.
+
+The store is a SQLite file shared by all uvicorn workers on the host, so
+lookups and writes run in a worker thread. Examples written against an older
+schema are deleted the first time a new schema version is seen. The store is
+disabled when `sqlite-vec` is not installed or no embedding deployment is
+configured.
+"""
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+from answer_cache import is_cacheable_answer, normalize_query
+from llm_client import AzureChatClient
+from ttl_cache import TTLCache
+
+try:
+    import sqlite_vec
+except ImportError:  # pragma: no cover - optional dependency
+    sqlite_vec = None
+
+logger = logging.getLogger("uvicorn")
+
+
+def final_sql(messages):
+    """Last `sql_db_query` statement in an agent transcript whose result was not an error, or `None`."""
+    queries = {}
+    sql = None
+    for message in messages:
+        for tool_call in getattr(message, "tool_calls", None) or ():
+            if tool_call["name"] == "sql_db_query":
+                queries[tool_call["id"]] = tool_call.get("args", {}).get("query")
+        if getattr(message, "type", None) == "tool" and message.tool_call_id in queries:
+            if not str(message.content).startswith("Error:"):
+                sql = queries[message.tool_call_id]
+    return sql
+
+
+def render_examples(examples):
+    return "\n\n".join(f"Question: {question}\nSQL: {sql}" for question, sql in examples)
+
+
+class SQLExampleStore:
+    def __init__(self, path, embedding_client, dimensions=1536, k=3, min_similarity=0.8):
+        self.path = path
+        self.embedding_client = embedding_client
+        self.dimensions = dimensions
+        self.k = k
+        self.min_similarity = min_similarity
+        self.lookups = 0
+        self.hits = 0
+        self.added = 0
+        self.pruned = 0
+        self._pruned_version = None
+        # Embeddings computed for a lookup, reused when the same question is added after the run.
+        self._pending_embeddings = TTLCache(maxsize=256, ttl=600)
+        self._lock = threading.Lock()
+        self._conn = self._open()
+
+    @classmethod
+    def from_config(cls, section):
+        """Build the store from `config.ini`; returns `None` when disabled or no embedding deployment is set."""
+        if not section.getboolean("sql_examples_enabled", fallback=True) or not section.get("azure_embedding_url"):
+            return None
+        if sqlite_vec is None:
+            logger.warning("sqlite-vec is not installed; few-shot SQL examples disabled")
+            return None
+        return cls(
+            section.get("sql_examples_path", fallback="sql_examples.db"),
+            AzureChatClient.from_config(section, url_key="azure_embedding_url", api_key_key="azure_embedding_api_key"),
+            dimensions=section.getint(
+                "sql_examples_embedding_dimensions",
+                fallback=section.getint("answer_cache_embedding_dimensions", fallback=1536),
+            ),
+            k=section.getint("sql_examples_k", fallback=3),
+            min_similarity=section.getfloat("sql_examples_min_similarity", fallback=0.8),
+        )
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+        conn.enable_load_extension(True)
+        sqlite_vec.load(conn)
+        conn.enable_load_extension(False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sql_examples ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL UNIQUE, sql TEXT NOT NULL, "
+            "schema_version TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS sql_example_vectors USING vec0("
+            f"embedding float[{self.dimensions}] distance_metric=cosine)"
+        )
+        conn.commit()
+        return conn
+
+    async def _embedding(self, key):
+        embedding = self._pending_embeddings.get(key, count=False)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = (await self.embedding_client.embed([key]))[0]
+        except Exception as e:
+            logger.warning(f"Few-shot example embedding failed: {e}")
+            return None
+        self._pending_embeddings.set(key, embedding)
+        return embedding
+
+    def _prune(self, schema_version):
+        """Drop examples written against another schema; they can never be retrieved again."""
+        if schema_version == self._pruned_version:
+            return
+        with self._lock:
+            stale = [
+                (row[0],) for row in self._conn.execute(
+                    "SELECT id FROM sql_examples WHERE schema_version != ?", (schema_version,)
+                )
+            ]
+            if stale:
+                self._conn.executemany("DELETE FROM sql_example_vectors WHERE rowid = ?", stale)
+                self._conn.executemany("DELETE FROM sql_examples WHERE id = ?", stale)
+                self._conn.commit()
+                self.pruned += len(stale)
+                logger.info(f"Pruned {len(stale)} few-shot SQL examples from older schema versions")
+            self._pruned_version = schema_version
+
+    def _search(self, embedding, schema_version):
+        self._prune(schema_version)
+        with self._lock:
+            return self._conn.execute(
+                "SELECT e.question, e.sql FROM ("
+                "SELECT rowid, distance FROM sql_example_vectors WHERE embedding MATCH ? AND k = ?) v "
+                "JOIN sql_examples e ON e.id = v.rowid "
+                "WHERE e.schema_version = ? AND v.distance <= ? ORDER BY v.distance",
+                (sqlite_vec.serialize_float32(embedding), self.k * 4, schema_version, 1 - self.min_similarity),
+            ).fetchall()[: self.k]
+
+    def _store(self, key, sql, embedding, schema_version):
+        self._prune(schema_version)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sql_examples(question, sql, schema_version, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(question) DO UPDATE SET sql = excluded.sql, schema_version = excluded.schema_version",
+                (key, sql.strip(), schema_version, time.time()),
+            )
+            (rowid,) = self._conn.execute("SELECT id FROM sql_examples WHERE question = ?", (key,)).fetchone()
+            self._conn.execute("DELETE FROM sql_example_vectors WHERE rowid = ?", (rowid,))
+            self._conn.execute(
+                "INSERT INTO sql_example_vectors(rowid, embedding) VALUES (?, ?)",
+                (rowid, sqlite_vec.serialize_float32(embedding)),
+            )
+            self._conn.commit()
+
+    async def examples_for(self, question, schema_version):
+        """Prompt-ready examples closest to `question` for this schema; empty if there are none."""
+        key = normalize_query(question)
+        if not key:
+            return ""
+        self.lookups += 1
+        embedding = await self._embedding(key)
+        if embedding is None:
+            return ""
+        # The store is a file shared by every worker; a locked database must not stall the event loop.
+        rows = await asyncio.to_thread(self._search, embedding, schema_version)
+        if not rows:
+            return ""
+        self.hits += 1
+        return render_examples(rows)
+
+    async def add(self, question, sql, answer, schema_version):
+        """Store a verified run: an executed statement and a usable answer. Newer SQL replaces older."""
+        key = normalize_query(question)
+        if not key or not sql or not is_cacheable_answer(answer):
+            return
+        embedding = await self._embedding(key)
+        if embedding is None:
+            return
+        await asyncio.to_thread(self._store, key, sql, embedding, schema_version)
+        self._pending_embeddings.pop(key)
+        self.added += 1
+
+    async def aclose(self):
+        await self.embedding_client.aclose()
+        with self._lock:
+            self._conn.close()
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "added": self.added,
+            "pruned": self.pruned,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+        }
@@ -0,0 +1,299 @@
+"""
+Execution limits for SQL written by the agent.
+
+`QueryGovernor` runs every `sql_db_query` statement on a pooled read-only
+connection under three limits, so a bad query costs at most a bounded amount
+of time instead of holding a worker thread until it finishes:
+  * plan   - `EXPLAIN QUERY PLAN` is checked before the statement runs; a
+             nested loop of full table scans whose estimated row product is
+             above `max_join_rows` (a Cartesian or unindexed join) is rejected
+  * time   - SQLite's progress handler aborts the statement after
+             `max_seconds` of wall-clock time or `max_vm_steps` VM instructions
+  * result - at most `max_rows` rows and `max_bytes` of formatted output are
+             returned; the rest is dropped and the truncation is reported
+
+Every execution is recorded in the optional `QueryLog` (time, rows, outcome
+and query plan) for the offline index advisor.
+
+Violations are returned to the agent as `Error: [CODE] message Hint: ...`
+strings (the same "Error:" convention `SQLDatabase.run_no_throw` uses), so
+the ReAct loop can rewrite the query instead of failing the request.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+import metrics
+from schema_catalog import db_fingerprint
+from tracing import tracer
+
+logger = logging.getLogger("uvicorn")
+
+# VM instructions between progress handler calls.
+PROGRESS_INTERVAL = 1000
+
+_SCAN = re.compile(r"^SCAN (?:TABLE )?([^\s(]+)")
+_ALIAS = re.compile(r"(?:\bfrom|\bjoin|,)\s*[\"`\[]?(\w+)[\"`\]]?\s+(?:as\s+)?[\"`\[]?(\w+)", re.I)
+_NOT_ALIASES = {"from", "where", "join", "inner", "left", "right", "cross", "natural", "on", "using", "group", "order",
+                "limit", "union", "except", "intersect", "having", "window", "full", "outer", "as"}
+
+
+def table_aliases(sql):
+    """`{alias: table}` for `FROM t a` / `JOIN t AS a` / `, t a` clauses; query plans name aliased tables by alias."""
+    return {
+        alias.lower(): table.lower()
+        for table, alias in _ALIAS.findall(sql)
+        if alias.lower() not in _NOT_ALIASES
+    }
+
+
+def scanned_table(detail, aliases):
+    """Table fully scanned by a query plan step, or `None`."""
+    match = _SCAN.match(detail)
+    if not match:
+        return None
+    name = match.group(1).strip('"`[]').lower()
+    return aliases.get(name, name)
+
+
+class GovernorError(Exception):
+    def __init__(self, code, message, hint=""):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.hint = hint
+
+    def to_dict(self):
+        return {"code": self.code, "message": self.message, "hint": self.hint}
+
+    def __str__(self):
+        return f"Error: [{self.code}] {self.message}" + (f" Hint: {self.hint}" if self.hint else "")
+
+
+def _truncate_value(value, length):
+    if isinstance(value, str) and len(value) > length:
+        return value[:length] + "..."
+    return value
+
+
+class QueryGovernor:
+    def __init__(
+        self,
+        engine,
+        db_path,
+        *,
+        max_seconds=10.0,
+        max_vm_steps=None,
+        max_rows=200,
+        max_bytes=16 * 1024,
+        max_join_rows=10_000_000,
+        max_string_length=300,
+        query_log=None,
+    ):
+        self.engine = engine
+        self.db_path = db_path
+        self.max_seconds = max_seconds
+        self.max_vm_steps = max_vm_steps
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_join_rows = max_join_rows
+        self.max_string_length = max_string_length
+        self.query_log = query_log
+        self.executed = 0
+        self.rejected = 0
+        self.interrupted = 0
+        self.truncated = 0
+        self._lock = threading.Lock()
+        self._table_rows = {}
+        self._table_rows_version = None
+
+    @classmethod
+    def from_config(cls, section, engine, db_path, query_log=None):
+        return cls(
+            engine,
+            db_path,
+            max_seconds=section.getfloat("sql_timeout_seconds", fallback=10.0) or None,
+            max_vm_steps=section.getint("sql_max_vm_steps", fallback=0) or None,
+            max_rows=section.getint("sql_max_rows", fallback=200),
+            max_bytes=section.getint("sql_max_result_bytes", fallback=16 * 1024),
+            max_join_rows=section.getint("sql_max_join_rows", fallback=10_000_000) or None,
+            query_log=query_log,
+        )
+
+    def table_rows(self, conn):
+        """Row count per table, recounted only when the database file changes."""
+        version = db_fingerprint(self.db_path)
+        with self._lock:
+            if version != self._table_rows_version:
+                counts = {}
+                for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                    quoted = name.replace('"', '""')
+                    counts[name.lower()] = conn.execute(f'SELECT COUNT(*) FROM "{quoted}"').fetchone()[0]
+                self._table_rows = counts
+                self._table_rows_version = version
+            return self._table_rows
+
+    def check_plan(self, conn, sql, parameters=()):
+        """The query plan as `(id, parent, detail)` rows; raises `GovernorError` for nested full scans
+        whose row product exceeds `max_join_rows`."""
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+        except sqlite3.Error as e:
+            raise GovernorError("SQL_ERROR", str(e), "Fix the statement and try again.") from e
+        plan = [(node, parent, detail) for node, parent, _, detail in plan]
+        if not self.max_join_rows:
+            return plan
+        # Rows sharing a parent are the nested loops of one SELECT.
+        scans = {}
+        aliases = table_aliases(sql)
+        for _, parent, detail in plan:
+            table = scanned_table(detail, aliases)
+            if table:
+                scans.setdefault(parent, []).append(table)
+        rows = None
+        for tables in scans.values():
+            if len(tables) < 2:
+                continue
+            if rows is None:
+                rows = self.table_rows(conn)
+            # Scans of subqueries/CTEs have no row count and are left to the time limit.
+            sized = [rows[table] for table in tables if table in rows]
+            estimate = 1
+            for count in sized:
+                estimate *= max(count, 1)
+            if len(sized) >= 2 and estimate > self.max_join_rows:
+                raise GovernorError(
+                    "FULL_SCAN_JOIN",
+                    f"Query plan joins full scans of {', '.join(tables)} (~{estimate:,} row combinations).",
+                    "Join the tables on a key column with an explicit ON condition and filter before joining.",
+                )
+        return plan
+
+    def _limits(self):
+        limits = []
+        if self.max_seconds:
+            limits.append(f"{self.max_seconds:g}s")
+        if self.max_vm_steps:
+            limits.append(f"{self.max_vm_steps:,} VM steps")
+        return " / ".join(limits)
+
+    def _progress_handler(self, deadline):
+        steps = 0
+
+        def handler():
+            nonlocal steps
+            steps += PROGRESS_INTERVAL
+            if deadline is not None and time.monotonic() > deadline:
+                return 1
+            if self.max_vm_steps is not None and steps > self.max_vm_steps:
+                return 1
+            return 0
+
+        return handler
+
+    def _fetch(self, cursor):
+        rows = []
+        size = 2
+        truncated = None
+        while True:
+            row = cursor.fetchone()
+            if row is None:
+                break
+            if len(rows) >= self.max_rows:
+                truncated = f"first {self.max_rows} rows"
+                break
+            row = tuple(_truncate_value(value, self.max_string_length) for value in row)
+            size += len(repr(row)) + 2
+            if rows and size > self.max_bytes:
+                truncated = f"first {len(rows)} rows ({self.max_bytes} byte limit)"
+                break
+            rows.append(row)
+        return rows, truncated
+
+    def execute(self, sql):
+        """Run `sql` under the plan, time and result limits; returns the result or an "Error: ..." string."""
+        try:
+            _, rows, truncated = self.fetch(sql)
+        except GovernorError as e:
+            return str(e)
+        if not rows:
+            return ""
+        result = str(rows)
+        if truncated:
+            result += f"\n[Result truncated to the {truncated}. Aggregate or add a LIMIT for the rest.]"
+        return result
+
+    def fetch(self, sql, parameters=()):
+        """Run `sql` with bound `parameters` under the limits; returns `(columns, rows, truncated)`
+        or raises `GovernorError`."""
+        started = time.perf_counter()
+        execution = {"plan": None, "rows": None}
+        status = "ok"
+        # A rejected statement is ordinary agent feedback, so it is an attribute rather than a span error.
+        span = tracer.start_span("sql", **{"db.statement": sql, "db.parameters": len(parameters)})
+        try:
+            return self._execute(sql, parameters, execution)
+        except GovernorError as e:
+            status = e.code
+            logger.warning(f"SQL governor rejected query ({e.code}): {sql!r}")
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            metrics.SQL_SECONDS.labels(status).observe(duration)
+            span.set("sql.status", status)
+            span.set("sql.rows", execution["rows"])
+            if execution["plan"] is not None:
+                span.set("sql.plan", " | ".join(str(row[-1]) for row in execution["plan"]))
+            span.end()
+            if self.query_log is not None:
+                self.query_log.record(sql, duration * 1000, execution["rows"], status, execution["plan"])
+
+    def _execute(self, sql, parameters, execution):
+        raw = self.engine.raw_connection()
+        conn = raw.driver_connection
+        try:
+            execution["plan"] = self.check_plan(conn, sql, parameters)
+            deadline = time.monotonic() + self.max_seconds if self.max_seconds else None
+            conn.set_progress_handler(self._progress_handler(deadline), PROGRESS_INTERVAL)
+            try:
+                cursor = conn.execute(sql, parameters)
+                columns = [column[0] for column in cursor.description or ()]
+                rows, truncated = self._fetch(cursor) if cursor.description else ([], None)
+                cursor.close()
+                execution["rows"] = len(rows)
+            except sqlite3.OperationalError as e:
+                if "interrupted" in str(e):
+                    with self._lock:
+                        self.interrupted += 1
+                    raise GovernorError(
+                        "QUERY_TIMEOUT",
+                        f"Query was stopped after exceeding the execution limit ({self._limits()}).",
+                        "Filter on indexed columns, aggregate, or add a LIMIT.",
+                    ) from e
+                raise GovernorError("SQL_ERROR", str(e), "Fix the statement and try again.") from e
+            except sqlite3.Error as e:
+                raise GovernorError("SQL_ERROR", str(e), "Fix the statement and try again.") from e
+            finally:
+                conn.set_progress_handler(None, 0)
+        except GovernorError:
+            with self._lock:
+                self.rejected += 1
+            raise
+        finally:
+            raw.close()
+
+        with self._lock:
+            self.executed += 1
+            if truncated:
+                self.truncated += 1
+        return columns, rows, truncated
+
+    def stats(self):
+        return {
+            "executed": self.executed,
+            "rejected": self.rejected,
+            "interrupted": self.interrupted,
+            "truncated": self.truncated,
+        }
@@ -0,0 +1,233 @@
+"""
+Parameterized SQL templates: a fast path in front of the SQL agent.
+
+Most traffic is a handful of question shapes with different parameters
+("<policy> for <country>", "how many X in <country>", top-N lists). Each
+shape is registered once in a JSON file (`sql_templates_path`, see
+`configs/sql_templates.json.example`) with:
+  * patterns - regexes matched against the whole normalized rephrased
+               query; `{slot}` marks where a slot value appears
+  * sql      - a read-only statement with `:slot` parameters
+  * slots    - how each slot is parsed:
+                 value  - one of the values of a low-cardinality column in
+                          the schema catalog (`"column": "table.column"`)
+                          or of its `aliases`; no match, no fast path
+                 text   - the captured text as-is
+                 number - digits or a number word, optional `default`/`max`
+                 year   - a four-digit year, optional `default`
+               a slot with a `default` (even `null`) may be left out of a
+               pattern; otherwise it must be captured and resolve
+  * answer   - optional `str.format` template over the slots and the
+               columns of the first row; `row` is appended once per row and
+               `empty` is used when there are none. Without `answer` the rows
+               are phrased by one `TEMPLATE_ANSWER` LLM call.
+
+A matched question costs one governed SQL execution (plus at most one short
+LLM call) instead of the 4-8 turns of the ReAct agent. Templates whose SQL
+does not validate against the live schema are skipped at startup, and any
+failure at run time falls back to the agent.
+"""
+import asyncio
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+
+from answer_cache import normalize_query
+from prompt_registry import TEMPLATE_ANSWER, registry as prompt_registry
+from sql_governor import GovernorError
+
+logger = logging.getLogger("uvicorn")
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9,
+    "ten": 10, "fifteen": 15, "twenty": 20, "fifty": 50, "hundred": 100,
+}
+
+SLOT_PATTERNS = {
+    "value": r".+?",
+    "text": r".+?",
+    "number": r"\d+|" + "|".join(NUMBER_WORDS),
+    "year": r"(?:19|20)\d{2}",
+}
+
+_UNRESOLVED = object()
+
+
+@dataclass(frozen=True)
+class SQLTemplate:
+    name: str
+    patterns: tuple
+    sql: str
+    slots: dict = field(default_factory=dict)
+    answer: str = None
+    row: str = None
+    empty: str = None
+
+    @classmethod
+    def from_dict(cls, spec):
+        slots = spec.get("slots", {})
+        for slot, options in slots.items():
+            if options.get("type", "value") not in SLOT_PATTERNS:
+                raise ValueError(f"template {spec['name']}: unknown slot type {options.get('type')!r} for {slot}")
+
+        def compile_pattern(pattern):
+            def slot_group(match):
+                slot = match.group(1)
+                if slot not in slots:
+                    raise ValueError(f"template {spec['name']}: pattern uses undeclared slot {{{slot}}}")
+                return f"(?P<{slot}>{SLOT_PATTERNS[slots[slot].get('type', 'value')]})"
+
+            return re.compile(re.sub(r"\{(\w+)\}", slot_group, pattern))
+
+        return cls(
+            name=spec["name"],
+            patterns=tuple(compile_pattern(pattern) for pattern in spec["patterns"]),
+            sql=spec["sql"],
+            slots=slots,
+            answer=spec.get("answer"),
+            row=spec.get("row"),
+            empty=spec.get("empty"),
+        )
+
+
+@dataclass(frozen=True)
+class TemplateMatch:
+    template: SQLTemplate
+    values: dict
+
+
+class SQLTemplateEngine:
+    def __init__(self, templates, schema_catalog, governor):
+        self.templates = list(templates)
+        self.schema_catalog = schema_catalog
+        self.governor = governor
+        self.matches = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.formatted = 0
+
+    @classmethod
+    def from_config(cls, section, schema_catalog, governor, validator=None):
+        """Load the templates from `sql_templates_path`; returns `None` when it is empty or has no valid template."""
+        path = section.get("sql_templates_path", fallback="")
+        if not path:
+            return None
+        templates = cls.load(path, validator)
+        if not templates:
+            return None
+        logger.info(f"Loaded {len(templates)} SQL templates from {path}")
+        return cls(templates, schema_catalog, governor)
+
+    @staticmethod
+    def load(path, validator=None):
+        """Parse a template file, skipping templates that are malformed or whose SQL does not validate."""
+        with open(path, encoding="utf-8") as f:
+            specs = json.load(f)
+        templates = []
+        for spec in specs:
+            try:
+                template = SQLTemplate.from_dict(spec)
+            except (KeyError, ValueError, re.error) as e:
+                logger.warning(f"Skipping SQL template {spec.get('name', '?')}: {e}")
+                continue
+            error = validator.check(template.sql) if validator is not None else None
+            if error is not None:
+                logger.warning(f"Skipping SQL template {template.name}: {error}")
+                continue
+            templates.append(template)
+        return templates
+
+    def _known_values(self, options):
+        """Normalized spelling -> stored value, from the catalog's column values and the slot's aliases."""
+        values = {}
+        column = options.get("column")
+        if column:
+            table, _, column = column.partition(".")
+            self.schema_catalog.refresh_if_changed()
+            for value in self.schema_catalog.tables.get(table, {}).get("values", {}).get(column, []):
+                values[normalize_query(str(value))] = value
+        for alias, value in options.get("aliases", {}).items():
+            values[normalize_query(alias)] = value
+        return values
+
+    def _slot_value(self, options, text):
+        kind = options.get("type", "value")
+        if text is None:
+            return options.get("default", _UNRESOLVED)
+        text = text.strip()
+        if kind == "number":
+            number = int(text) if text.isdigit() else NUMBER_WORDS[text]
+            return min(number, options.get("max", number))
+        if kind == "year":
+            return int(text)
+        if kind == "text":
+            return text
+        return self._known_values(options).get(normalize_query(text), _UNRESOLVED)
+
+    def match(self, question):
+        """The first template whose pattern matches the whole normalized question with every slot resolved."""
+        normalized = normalize_query(question)
+        for template in self.templates:
+            for pattern in template.patterns:
+                found = pattern.fullmatch(normalized)
+                if found is None:
+                    continue
+                values = {
+                    slot: self._slot_value(options, found.groupdict().get(slot))
+                    for slot, options in template.slots.items()
+                }
+                if _UNRESOLVED not in values.values():
+                    return TemplateMatch(template, values)
+        return None
+
+    def render(self, match, columns, rows):
+        """Answer from the template's text fields, or `None` when it has none (or they do not fit the rows)."""
+        template = match.template
+        try:
+            if not rows:
+                return template.empty.format(**match.values) if template.empty else None
+            if template.answer is None:
+                return None
+            first = dict(zip(columns, rows[0]))
+            text = template.answer.format(**{**first, **match.values})
+            if template.row:
+                lines = [template.row.format(**{**match.values, **dict(zip(columns, row))}) for row in rows]
+                text = "\n".join([text, *lines])
+            return text
+        except (KeyError, IndexError, ValueError) as e:
+            logger.warning(f"SQL template {template.name} answer does not fit the result: {e}")
+            return None
+
+    async def answer(self, question, chat_client):
+        """Answer `question` through a matching template, or `None` to fall back to the SQL agent."""
+        match = self.match(question)
+        if match is None:
+            self.misses += 1
+            return None
+        self.matches += 1
+        try:
+            columns, rows, _ = await asyncio.to_thread(self.governor.fetch, match.template.sql, match.values)
+        except GovernorError:
+            self.fallbacks += 1
+            return None
+        logger.info(f"SQL template {match.template.name} matched with {match.values}")
+
+        text = self.render(match, columns, rows)
+        if text is not None:
+            return text
+        result = await chat_client.chat(
+            TEMPLATE_ANSWER.messages(question=question, columns=", ".join(columns), rows=str(rows))
+        )
+        prompt_registry.record_result("template_answer", result)
+        self.formatted += 1
+        return result.content
+
+    def stats(self):
+        return {
+            "templates": len(self.templates),
+            "matches": self.matches,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+            "llm_formatted": self.formatted,
+        }
@@ -0,0 +1,69 @@
+"""
+SQL tools handed to the SQL agent.
+
+Starts from `SQLDatabaseToolkit.get_tools()` and swaps:
+  * `sql_db_query` for a subclass that runs statements through
+    `QueryGovernor` (plan check, time and result limits) and serves repeated
+    statements from `QueryResultCache`
+  * `sql_db_query_checker` (an LLM call per check) for `SQLValidator`, which
+    prepares the query against the real schema locally
+Tool names and descriptions are unchanged, so the agent prompt needs no changes.
+"""
+from typing import Any, Optional
+
+from langchain_community.tools.sql_database.tool import (
+    BaseSQLDatabaseTool,
+    QuerySQLCheckerTool,
+    QuerySQLDatabaseTool,
+)
+from langchain_core.tools import BaseTool
+from pydantic import Field
+
+
+class GovernedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """`sql_db_query` that runs under a `QueryGovernor` and memoizes results in a `QueryResultCache`."""
+
+    cache: Optional[Any] = Field(default=None, exclude=True)
+    governor: Optional[Any] = Field(default=None, exclude=True)
+
+    def _execute(self, query):
+        if self.governor is None:
+            return self.db.run_no_throw(query)
+        return self.governor.execute(query)
+
+    def _run(self, query, run_manager=None):
+        if self.cache is None:
+            return self._execute(query)
+        return self.cache.get_or_run(query, lambda: self._execute(query))
+
+
+class ValidateSQLQueryTool(BaseSQLDatabaseTool, BaseTool):
+    """`sql_db_query_checker` backed by a local `SQLValidator` instead of an LLM chain."""
+
+    name: str = "sql_db_query_checker"
+    description: str = "Check that a SQL query is valid against the database schema before executing it."
+    validator: Any = Field(exclude=True)
+
+    def _run(self, query, run_manager=None):
+        return self.validator.validate(query)
+
+
+def build_sql_tools(toolkit, query_cache=None, governor=None, validator=None, callbacks=None):
+    """
+    Toolkit tools with `sql_db_query` governed and cached and, given a validator, a local query checker.
+    `callbacks` are attached to every tool (e.g. `AgentMetricsCallback` for per-call timings).
+    """
+    tools = []
+    for tool in toolkit.get_tools():
+        if isinstance(tool, QuerySQLDatabaseTool):
+            tool = GovernedQuerySQLDatabaseTool(
+                db=tool.db, description=tool.description, cache=query_cache, governor=governor
+            )
+        elif isinstance(tool, QuerySQLCheckerTool) and validator is not None:
+            tool = ValidateSQLQueryTool(
+                db=tool.db, description=tool.description, args_schema=tool.args_schema, validator=validator
+            )
+        if callbacks is not None:
+            tool.callbacks = callbacks
+        tools.append(tool)
+    return tools
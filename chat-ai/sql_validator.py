@@ -0,0 +1,143 @@
+"""
+Local replacement for the LLM-backed `sql_db_query_checker` tool.
+
+The toolkit's checker asks Azure to re-read every query, which costs an extra
+LLM call on most questions. `SQLValidator` instead compiles the statement
+against the real schema with `EXPLAIN` on a pooled read-only connection
+(prepared, never run), which catches syntax errors, unknown tables and
+columns and multiple statements in microseconds. Anything that is not a
+single read-only statement (DML, DDL, PRAGMA, ATTACH) is rejected by its
+leading keyword and, for anything that slips past that (`WITH ... DELETE`),
+by an authorizer that only allows reads while the statement is prepared.
+Read-only introspection pragmas used as table-valued functions
+(`SELECT * FROM pragma_table_info('t')`) are allowed.
+
+Unknown names come back with the closest table/column names from the schema
+catalog, so the agent can fix the query without a schema lookup.
+"""
+import difflib
+import logging
+import re
+import sqlite3
+import threading
+
+logger = logging.getLogger("uvicorn")
+
+WRITE_STATEMENTS = {
+    "alter", "analyze", "attach", "begin", "commit", "create", "delete", "detach", "drop", "end", "insert",
+    "pragma", "reindex", "release", "replace", "rollback", "savepoint", "update", "upsert", "vacuum",
+}
+
+# Authorizer actions a read-only query needs; everything else is denied at prepare time.
+_READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# Introspection pragmas that are safe as table-valued functions (`FROM pragma_table_info('t')`).
+READ_ONLY_PRAGMAS = {
+    "collation_list", "database_list", "foreign_key_list", "function_list", "index_info", "index_list",
+    "index_xinfo", "module_list", "pragma_list", "table_info", "table_list", "table_xinfo",
+}
+
+_PRAGMA_FUNCTION = re.compile(r"\bpragma_(\w+)", re.I)
+_LEADING_KEYWORD = re.compile(r"^\s*(?:(?:--[^\n]*(?:\n|$)|/\*.*?\*/)\s*)*([a-zA-Z]+)", re.S)
+_UNKNOWN_NAME = re.compile(r"no such (table|column): (\S+)")
+
+
+def _read_only_authorizer(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in _READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _pragma_function_authorizer(action, arg1, arg2, db_name, trigger):
+    # Preparing a pragma table-valued function checks SQLITE_UPDATE on sqlite_master while the
+    # eponymous virtual table is set up; nothing is written.
+    if action == sqlite3.SQLITE_UPDATE and arg1 == "sqlite_master":
+        return sqlite3.SQLITE_OK
+    return _read_only_authorizer(action, arg1, arg2, db_name, trigger)
+
+
+class SQLValidator:
+    def __init__(self, engine, schema_catalog=None):
+        self.engine = engine
+        self.schema_catalog = schema_catalog
+        self.valid = 0
+        self.invalid = 0
+        self._lock = threading.Lock()
+
+    def _tables_with(self, column):
+        return [
+            name for name, table in self.schema_catalog.tables.items()
+            if any(c["name"] == column for c in table["columns"])
+        ]
+
+    def _suggest(self, kind, name):
+        if self.schema_catalog is None:
+            return ""
+        self.schema_catalog.refresh_if_changed()
+        name = name.split(".")[-1].strip('"`[]')
+        if kind == "table":
+            candidates = list(self.schema_catalog.tables)
+        else:
+            candidates = sorted({
+                column["name"] for table in self.schema_catalog.tables.values() for column in table["columns"]
+            })
+        matches = difflib.get_close_matches(name, candidates, n=3, cutoff=0.6)
+        if not matches and kind == "table":
+            return f" Available tables: {', '.join(candidates)}."
+        if not matches:
+            return ""
+        if kind == "column":
+            matches = [f"{column} ({', '.join(self._tables_with(column))})" for column in matches]
+        return f" Did you mean: {', '.join(matches)}?"
+
+    def _error(self, exc):
+        message = str(exc)
+        unknown = _UNKNOWN_NAME.search(message)
+        if unknown:
+            message += self._suggest(unknown.group(1), unknown.group(2))
+        return f"Error: {message}"
+
+    def check(self, sql):
+        """`None` if `sql` is a single read-only statement valid against the schema, else the error message."""
+        if not sql or not sql.strip():
+            return "Error: the query is empty."
+        match = _LEADING_KEYWORD.match(sql)
+        keyword = match.group(1).lower() if match else ""
+        if keyword in WRITE_STATEMENTS:
+            return f"Error: only read-only SELECT queries are allowed, got {keyword.upper()}."
+
+        pragmas = {name.lower() for name in _PRAGMA_FUNCTION.findall(sql)}
+        if pragmas - READ_ONLY_PRAGMAS:
+            return (
+                f"Error: pragma_{sorted(pragmas - READ_ONLY_PRAGMAS)[0]} is not allowed. Read-only pragma "
+                f"functions you can use: {', '.join('pragma_' + name for name in sorted(READ_ONLY_PRAGMAS))}."
+            )
+
+        raw = self.engine.raw_connection()
+        conn = raw.driver_connection
+        conn.set_authorizer(_pragma_function_authorizer if pragmas else _read_only_authorizer)
+        try:
+            conn.execute(f"EXPLAIN {sql}").fetchall()
+        except (sqlite3.Error, sqlite3.Warning) as e:
+            # Multiple statements raise sqlite3.Warning before Python 3.12, ProgrammingError after.
+            if "not authorized" in str(e):
+                return "Error: the query writes to or alters the database; only read-only SELECT queries are allowed."
+            return self._error(e)
+        finally:
+            conn.set_authorizer(None)
+            raw.close()
+        return None
+
+    def validate(self, sql):
+        """Tool output: the query unchanged when valid (as the LLM checker returns it), else the error."""
+        error = self.check(sql)
+        with self._lock:
+            if error is None:
+                self.valid += 1
+            else:
+                self.invalid += 1
+        if error is not None:
+            logger.info(f"SQL validator rejected query: {error}")
+            return error
+        return sql
+
+    def stats(self):
+        return {"valid": self.valid, "invalid": self.invalid}
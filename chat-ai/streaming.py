@@ -0,0 +1,116 @@
+"""
+Server-Sent Events helpers for the streaming `/invocations/stream` endpoints.
+
+`agent_events` turns the ReAct SQL agent's LangGraph stream into a flat
+sequence of `(event, data)` pairs: answer tokens as they are generated and
+the intermediate tool steps (table listing, schema lookup, SQL executed).
+"""
+import json
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+
+import metrics
+from prompt_registry import registry as prompt_registry
+from sql_examples import final_sql
+from tracing import tracer
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Access-Control-Allow-Origin": "*",
+}
+
+# Human readable step names for the SQLDatabaseToolkit tools.
+TOOL_STEPS = {
+    "sql_db_list_tables": "list_tables",
+    "sql_db_schema": "schema_lookup",
+    "sql_db_query": "sql_executed",
+    "sql_db_query_checker": "query_check",
+}
+
+MAX_STEP_CONTENT = 2000
+
+
+def sse_event(event, data):
+    """Format one SSE frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def _truncate(text, limit=MAX_STEP_CONTENT):
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def trace_agent_step(node, messages, started_ns, step):
+    """Record one finished ReAct step (a model turn or a round of tool results) as an `agent.step` span."""
+    attributes = {"agent.node": node, "agent.step": step}
+    tool_calls = [call["name"] for message in messages if isinstance(message, AIMessage) for call in message.tool_calls]
+    tools = [message.name for message in messages if isinstance(message, ToolMessage)]
+    if tool_calls:
+        attributes["agent.tool_calls"] = ",".join(tool_calls)
+    if tools:
+        attributes["agent.tool_results"] = ",".join(tools)
+    tracer.record_span("agent.step", started_ns, **attributes)
+
+
+async def agent_events(agent, query, inputs=None, **kwargs):
+    """
+    Run `agent` on `query` and yield `(event, data)` pairs as the run progresses.
+    `inputs` adds extra keys to the agent's input state (e.g. `schema_context`).
+
+    Events:
+      token  - {"text"}: a chunk of model output from the agent node
+      step   - {"step", "tool", "args"} when a tool is called and
+               {"step", "tool", "result"} when it returns
+      answer - {"text", "sql"}: the final answer (last AI message without tool
+               calls) and the last SQL statement that ran without error
+    """
+    answer = ""
+    ai_messages = []
+    transcript = []
+    step_started = time.time_ns()
+    async for mode, chunk in agent.astream(
+        {"messages": [{"role": "user", "content": query}], **(inputs or {})},
+        stream_mode=["messages", "updates"],
+        **kwargs,
+    ):
+        if mode == "messages":
+            message, metadata = chunk
+            if (
+                isinstance(message, AIMessageChunk)
+                and metadata.get("langgraph_node") == "agent"
+                and isinstance(message.content, str)
+                and message.content
+            ):
+                yield "token", {"text": message.content}
+            continue
+
+        for node, update in chunk.items():
+            if not isinstance(update, dict):
+                continue
+            trace_agent_step(node, update.get("messages", []), step_started, len(transcript))
+            step_started = time.time_ns()
+            for message in update.get("messages", []):
+                transcript.append(message)
+                if isinstance(message, AIMessage):
+                    ai_messages.append(message)
+                    if message.tool_calls:
+                        for tool_call in message.tool_calls:
+                            yield "step", {
+                                "step": TOOL_STEPS.get(tool_call["name"], tool_call["name"]),
+                                "tool": tool_call["name"],
+                                "args": tool_call.get("args", {}),
+                            }
+                    else:
+                        answer = str(message.content)
+                elif isinstance(message, ToolMessage):
+                    yield "step", {
+                        "step": TOOL_STEPS.get(message.name, message.name),
+                        "tool": message.name,
+                        "result": _truncate(message.content),
+                    }
+
+    prompt_registry.record_messages("sql_agent", ai_messages)
+    metrics.AGENT_ITERATIONS.observe(len(ai_messages))
+    yield "answer", {"text": answer, "sql": final_sql(transcript)}
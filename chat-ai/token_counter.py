@@ -0,0 +1,56 @@
+"""
+Token counting for prompt budgets.
+
+Uses the `tiktoken` encoding of the Azure deployment (`cl100k_base` for
+gpt-4). When the encoding cannot be loaded (tiktoken downloads the BPE file on
+first use, which fails on hosts without internet access unless
+`TIKTOKEN_CACHE_DIR` is pre-populated) counts fall back to a
+4-characters-per-token estimate.
+"""
+import functools
+import logging
+import math
+
+logger = logging.getLogger("uvicorn")
+
+DEFAULT_ENCODING = "cl100k_base"
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=DEFAULT_ENCODING):
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {name} unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text, encoding=DEFAULT_ENCODING):
+    if not text:
+        return 0
+    enc = get_encoding(encoding)
+    if enc is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, encoding=DEFAULT_ENCODING):
+    """Chat-completions accounting: ~4 tokens of framing per message plus 3 for the reply primer."""
+    return sum(4 + count_tokens(msg.get("content") or "", encoding) for msg in messages) + 3
+
+
+def truncate(text, max_tokens, encoding=DEFAULT_ENCODING):
+    """Cut `text` to at most `max_tokens` tokens, marking the cut with an ellipsis."""
+    if max_tokens <= 0:
+        return ""
+    enc = get_encoding(encoding)
+    if enc is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= limit else text[:limit].rstrip() + " ..."
+    tokens = enc.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return enc.decode(tokens[:max_tokens]).rstrip() + " ..."
@@ -0,0 +1,339 @@
+"""
+Per-request trace trees.
+
+`tracer.trace(name, request_id)` opens the root span of a request; spans
+opened inside it (`tracer.span`, also from worker threads, since context vars
+follow `asyncio.to_thread` and LangChain's executors) nest under the current
+span. Outside a trace every call is a no-op, so library code can be traced
+unconditionally.
+
+When the root span ends the sampler decides whether to keep the whole tree:
+requests slower than `trace_slow_seconds`, failed requests, and a
+`trace_sample_rate` share of the rest. Kept traces are handed to a
+background thread that appends them to `trace_path` (one JSON object per
+line) and/or POSTs them as OTLP/HTTP JSON to `trace_otlp_endpoint`
+(e.g. http://localhost:4318 for an OpenTelemetry collector or Jaeger).
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("uvicorn")
+
+MAX_ATTRIBUTE_CHARS = 2000
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+def _attribute(value):
+    if isinstance(value, (bool, int, float)) or value is None:
+        return value
+    text = str(value)
+    return text if len(text) <= MAX_ATTRIBUTE_CHARS else text[:MAX_ATTRIBUTE_CHARS] + "..."
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, trace, name, parent_id, attributes):
+        self.trace = trace
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {key: _attribute(value) for key, value in attributes.items()}
+        self.error = None
+        self._token = None
+
+    def set(self, key, value):
+        self.attributes[key] = _attribute(value)
+
+    def set_error(self, error):
+        self.error = _attribute(error)
+        self.trace.error = True
+
+    def end(self, end_ns=None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # Ended from another context (e.g. a callback thread); just stop being current there.
+                pass
+            self._token = None
+        self.trace.add(self)
+
+    def to_dict(self, origin_ns):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ms": (self.start_ns - origin_ns) / 1e6,
+            "duration_ms": ((self.end_ns or self.start_ns) - self.start_ns) / 1e6,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    span_id = None
+
+    def set(self, key, value):
+        pass
+
+    def set_error(self, error):
+        pass
+
+    def end(self, end_ns=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, tracer, request_id, max_spans):
+        self.tracer = tracer
+        self.trace_id = _new_id(16)
+        self.request_id = request_id or self.trace_id
+        self.max_spans = max_spans
+        self.spans = []
+        self.dropped = 0
+        self.error = False
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) < self.max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.service = "chat-ai"
+        self.path = None
+        self.otlp_endpoint = None
+        self.slow_seconds = 10.0
+        self.sample_rate = 0.0
+        self.max_spans = 500
+        self.traces = 0
+        self.kept = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=1000)
+        self._thread = None
+        self._rng = random.Random()
+
+    def configure(self, section, service):
+        """Read the `tracing_*` / `trace_*` keys of config.ini and start the export thread."""
+        self.enabled = section.getboolean("tracing_enabled", fallback=False)
+        self.service = service
+        self.path = section.get("trace_path", fallback="") or None
+        self.otlp_endpoint = (section.get("trace_otlp_endpoint", fallback="") or "").rstrip("/") or None
+        self.slow_seconds = section.getfloat("trace_slow_seconds", fallback=10.0)
+        self.sample_rate = section.getfloat("trace_sample_rate", fallback=0.0)
+        self.max_spans = section.getint("trace_max_spans", fallback=500)
+        if self.enabled and not (self.path or self.otlp_endpoint):
+            logger.warning("Tracing enabled without trace_path or trace_otlp_endpoint; disabling it")
+            self.enabled = False
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+            self._thread.start()
+        return self
+
+    # --- Spans --------------------------------------------------------------------------
+
+    @contextmanager
+    def trace(self, name, request_id, **attributes):
+        """Root span of one request; the tree is sampled and exported when it ends."""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        trace = Trace(self, request_id, self.max_spans)
+        root = Span(trace, name, None, {"request_id": trace.request_id, **attributes})
+        trace_token = _current_trace.set(trace)
+        span_token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.set_error(e)
+            raise
+        finally:
+            root.end()
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            self._finish(trace, root)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Child of the current span; a no-op outside a trace."""
+        span = self.start_span(name, activate=True, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            span.end()
+
+    def start_span(self, name, activate=False, **attributes):
+        """
+        Open a span to be closed with `span.end()`, for callbacks without a `with` block.
+        `activate` makes it the parent of spans opened later in this context.
+        """
+        trace = _current_trace.get()
+        if trace is None:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        span = Span(trace, name, parent.span_id if parent is not None else None, attributes)
+        if activate:
+            span._token = _current_span.set(span)
+        return span
+
+    def record_error(self, error):
+        """Mark the current span (and so the trace) failed, for errors that are handled rather than raised."""
+        span = _current_span.get()
+        if span is not None:
+            span.set_error(error)
+
+    def record_span(self, name, start_ns, end_ns=None, **attributes):
+        """Add an already-timed span (e.g. an agent step observed after it finished)."""
+        span = self.start_span(name, **attributes)
+        if span is not NOOP_SPAN:
+            span.start_ns = start_ns
+            span.end(end_ns)
+        return span
+
+    # --- Sampling and export ------------------------------------------------------------
+
+    def _finish(self, trace, root):
+        self.traces += 1
+        duration = (root.end_ns - root.start_ns) / 1e9
+        if trace.error:
+            reason = "error"
+        elif duration >= self.slow_seconds:
+            reason = "slow"
+        elif self.sample_rate and self._rng.random() < self.sample_rate:
+            reason = "sampled"
+        else:
+            return
+        try:
+            self._queue.put_nowait((trace, root, reason))
+            self.kept += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def _record(self, trace, root, reason):
+        spans = sorted(trace.spans, key=lambda span: span.start_ns)
+        return {
+            "trace_id": trace.trace_id,
+            "request_id": trace.request_id,
+            "service": self.service,
+            "name": root.name,
+            "start": root.start_ns / 1e9,
+            "duration_ms": (root.end_ns - root.start_ns) / 1e6,
+            "status": "error" if trace.error else "ok",
+            "kept": reason,
+            "dropped_spans": trace.dropped,
+            "spans": [span.to_dict(root.start_ns) for span in spans],
+        }
+
+    def _otlp(self, batch):
+        def value(item):
+            if isinstance(item, bool):
+                return {"boolValue": item}
+            if isinstance(item, int):
+                return {"intValue": str(item)}
+            if isinstance(item, float):
+                return {"doubleValue": item}
+            return {"stringValue": "" if item is None else str(item)}
+
+        spans = []
+        for trace, root, reason in batch:
+            for span in trace.spans:
+                otlp_span = {
+                    "traceId": trace.trace_id,
+                    "spanId": span.span_id,
+                    "name": span.name,
+                    "kind": 2 if span is root else 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                    "attributes": [{"key": key, "value": value(item)} for key, item in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                }
+                if span.parent_id:
+                    otlp_span["parentSpanId"] = span.parent_id
+                if span is root:
+                    otlp_span["attributes"].append({"key": "trace.kept", "value": value(reason)})
+                spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": value(self.service)}]},
+                "scopeSpans": [{"scope": {"name": "chat-ai.tracing"}, "spans": spans}],
+            }]
+        }
+
+    def _export(self, batch):
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for trace, root, reason in batch:
+                    f.write(json.dumps(self._record(trace, root, reason), default=str) + "\n")
+        if self.otlp_endpoint:
+            import httpx
+
+            response = httpx.post(f"{self.otlp_endpoint}/v1/traces", json=self._otlp(batch), timeout=5.0)
+            if response.status_code >= 400:
+                logger.warning(f"OTLP trace export returned {response.status_code}: {response.text[:200]}")
+
+    def _export_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < 100:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._safe_export(batch)
+                    return
+                batch.append(item)
+            self._safe_export(batch)
+
+    def _safe_export(self, batch):
+        try:
+            self._export(batch)
+        except Exception as e:
+            logger.warning(f"Trace export failed, dropped {len(batch)} traces: {e}")
+
+    def close(self, timeout=5.0):
+        """Flush queued traces and stop the export thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        return {"traces": self.traces, "kept": self.kept, "dropped": self.dropped, "queued": self._queue.qsize()}
+
+
+tracer = Tracer()